@@ -0,0 +1,140 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+import numpy as np
+
+import metrics
+
+
+def normalize_question(question: str) -> str:
+    """Нормализация вопроса для точного совпадения: регистр, пробелы, конечная пунктуация."""
+    question = re.sub(r'\s+', ' ', question.lower()).strip()
+    return question.rstrip(' ?!.')
+
+
+class AnswerCache:
+    """Кэш ответов LLM для повторяющихся и почти совпадающих вопросов.
+
+    Точное совпадение — по (хэш документа, нормализованный вопрос, позиции найденных чанков).
+    Близкое совпадение — по косинусной близости эмбеддингов вопросов к одному документу
+    не ниже similarity_threshold.
+
+    Args:
+        max_items: максимальное число ответов в кэше (вытесняются давно не использованные)
+        ttl: время жизни ответа в секундах с момента сохранения (None — без ограничения)
+        similarity_threshold: порог косинусной близости для близкого совпадения
+            (None — только точные совпадения)
+    """
+
+    def __init__(self, max_items: int = 1024, ttl: Optional[float] = 3600,
+                 similarity_threshold: Optional[float] = 0.95):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._items: "OrderedDict[Tuple, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(doc_hash: str, question: str, chunk_ids: Iterable[Hashable]) -> Tuple:
+        return doc_hash, normalize_question(question), tuple(sorted(chunk_ids))
+
+    def get(self, doc_hash: str, question: str, chunk_ids: Iterable[Hashable],
+            query_embedding=None) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Поиск ответа в кэше.
+
+        Returns:
+            (ответ, тип совпадения 'exact' | 'semantic') или (None, None)
+        """
+        key = self.make_key(doc_hash, question, chunk_ids)
+        with self._lock:
+            self._expire()
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+                self.exact_hits += 1
+                metrics.record_cache('answer', True)
+                return entry['answer'], 'exact'
+
+            if query_embedding is not None and self.similarity_threshold is not None:
+                match = self._nearest(doc_hash, self._normalize(query_embedding))
+                if match is not None:
+                    self._items.move_to_end(match[0])
+                    self.semantic_hits += 1
+                    metrics.record_cache('answer', True)
+                    return match[1]['answer'], 'semantic'
+
+            self.misses += 1
+            metrics.record_cache('answer', False)
+            return None, None
+
+    def put(self, doc_hash: str, question: str, chunk_ids: Iterable[Hashable], answer: str,
+            query_embedding=None) -> None:
+        key = self.make_key(doc_hash, question, chunk_ids)
+        entry = {
+            'answer': answer,
+            'doc_hash': doc_hash,
+            'embedding': self._normalize(query_embedding) if query_embedding is not None else None,
+            'created_at': time.monotonic(),
+        }
+        with self._lock:
+            self._items[key] = entry
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def discard_document(self, doc_hash: str) -> int:
+        """Удаление ответов по версии документа (например, после изменения его текста)."""
+        with self._lock:
+            keys = [key for key, entry in self._items.items() if entry['doc_hash'] == doc_hash]
+            for key in keys:
+                del self._items[key]
+            return len(keys)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                'size': len(self._items),
+                'exact_hits': self.exact_hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'hit_rate': (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            }
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype='float32').ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _nearest(self, doc_hash: str, embedding: np.ndarray):
+        candidates = [(key, entry) for key, entry in self._items.items()
+                      if entry['doc_hash'] == doc_hash and entry['embedding'] is not None
+                      and entry['embedding'].shape == embedding.shape]
+        if not candidates:
+            return None
+
+        similarities = np.stack([entry['embedding'] for _, entry in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        return candidates[best]
+
+    def _expire(self) -> None:
+        if self.ttl is None:
+            return
+        deadline = time.monotonic() - self.ttl
+        expired = [key for key, entry in self._items.items() if entry['created_at'] < deadline]
+        for key in expired:
+            del self._items[key]
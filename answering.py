@@ -1,4 +1,13 @@
-import ollama
+import logging
+import time
+from typing import Dict, Iterator, List, Optional
+
+import metrics
+from llm_client import LLMClient
+
+logger = logging.getLogger(__name__)
+
+NOT_FOUND_ANSWER = "Ответ на этот вопрос не найден в предоставленном документе"
 
 SYSTEM_PROMPT = """\
 Ты — ассистент для ответов на вопросы по документам.
@@ -12,14 +21,12 @@ SYSTEM_PROMPT = """\
 """
 
 class AnswerFormatter:
-    def __init__(self, model: str = "gpt-oss:120b-cloud"):
+    def __init__(self, model: str = "gpt-oss:120b-cloud", client: Optional[LLMClient] = None):
         self.model = model
+        self.client = client if client is not None else LLMClient()
 
-    def generate_answer(self, query: str, context: str) -> str:
-        """Generate an answer based on the query and provided context."""
-        if not context.strip():
-            return "Ответ на этот вопрос не найден в предоставленном документе"
-        
+    def _build_messages(self, query: str, context: str) -> List[Dict[str, str]]:
+        """Сообщения для LLM: системный промпт и вопрос с контекстом."""
         user_message = f"""\
         Вопрос:
         {query}
@@ -30,7 +37,7 @@ class AnswerFormatter:
         Ответь на вопрос, опираясь ТОЛЬКО на предоставленный контекст.
         """
 
-        response = ollama.chat(model=self.model, messages=[
+        return [
                 {
                     "role": "system",
                     "content": SYSTEM_PROMPT
@@ -39,9 +46,45 @@ class AnswerFormatter:
                     "role": "user",
                     "content": user_message
                 }
-        ])
+        ]
+
+    def generate_answer(self, query: str, context: str) -> str:
+        """Generate an answer based on the query and provided context."""
+        if not context.strip():
+            return NOT_FOUND_ANSWER
+
+        with metrics.in_flight('llm_generation'), metrics.timed('llm_generation'):
+            response = self.client.chat(model=self.model, messages=self._build_messages(query, context))
         return response['message']['content']
 
+    def stream_answer(self, query: str, context: str) -> Iterator[str]:
+        """Stream the answer token by token as the model generates it."""
+        if not context.strip():
+            yield NOT_FOUND_ANSWER
+            return
+
+        start = time.perf_counter()
+        first_token_time = None
+        with metrics.in_flight('llm_generation'):
+            try:
+                stream = self.client.stream_chat(model=self.model, messages=self._build_messages(query, context))
+                for part in stream:
+                    token = part['message']['content']
+                    if not token:
+                        continue
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter() - start
+                        metrics.observe('llm_first_token', first_token_time)
+                        logger.info(f"Время до первого токена: {first_token_time:.2f} с")
+                    yield token
+            except Exception:
+                metrics.ERRORS.inc(stage='llm_generation')
+                raise
+
+        elapsed = time.perf_counter() - start
+        metrics.observe('llm_generation', elapsed)
+        logger.info(f"Время генерации ответа: {elapsed:.2f} с")
+
     
 if __name__ == "__main__":
     pass
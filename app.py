@@ -1,15 +1,327 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify, stream_with_context
+import json
+import os
+import tempfile
+import threading
+import time
 import uuid
+from typing import Dict, Optional
 
 from text_extractor import TextExtractor
-from searching import SemanticSearch
+from searching import RETRIEVAL_MODES, DocumentIndex, SemanticSearch, chunk_stream
 from answering import AnswerFormatter
+from llm_client import LLMBusyError, LLMClient, LLMError, LLMTimeoutError
+from embeddings import DEFAULT_MODEL, DEFAULT_RERANKER, model_registry
+from index_cache import IndexCache
+from disk_cache import DiskIndexCache
+from corpus import CorpusIndex
+from jobs import FAILED, READY, JobManager
+from answer_cache import AnswerCache
+from batching import query_encoder
+from document_store import make_document_store
+import metrics
 
 app = Flask(__name__)
 
-text_storage = {}
-text_extractor = TextExtractor()
-formatter = AnswerFormatter()
+EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', DEFAULT_MODEL)
+EMBEDDING_DEVICE = os.environ.get('EMBEDDING_DEVICE') or None
+RERANKER_MODEL = os.environ.get('RERANKER_MODEL', DEFAULT_RERANKER)
+# Ограничение контекста, передаваемого LLM, в токенах
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 2000))
+# Тип хранения векторов в FAISS: float32, float16 или int8
+VECTOR_DTYPE = os.environ.get('VECTOR_DTYPE', 'float32')
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+model_registry.max_models = int(os.environ.get('MAX_EMBEDDING_MODELS', model_registry.max_models))
+# Бэкенд модели эмбеддингов: torch, onnx или onnx-int8
+model_registry.backend = os.environ.get('EMBEDDING_BACKEND', model_registry.backend)
+model_registry.batch_size = int(os.environ.get('EMBEDDING_BATCH_SIZE', model_registry.batch_size))
+model_registry.threads = int(os.environ.get('EMBEDDING_THREADS', 0)) or None
+model_registry.max_seq_length = int(os.environ.get('EMBEDDING_MAX_SEQ_LENGTH', 0)) or None
+model_registry.quantization = os.environ.get('EMBEDDING_QUANTIZATION', model_registry.quantization)
+model_registry.onnx_dir = os.path.join(CACHE_DIR, 'onnx')
+# Вопросы одновременных запросов векторизуются общим батчем
+query_encoder.window_ms = float(os.environ.get('QUERY_BATCH_WINDOW_MS', query_encoder.window_ms))
+query_encoder.max_batch = int(os.environ.get('QUERY_BATCH_MAX_SIZE', query_encoder.max_batch))
+
+document_store = make_document_store(
+    os.environ.get('DOCUMENT_STORE', 'memory'),
+    max_bytes=int(os.environ.get('DOCUMENT_STORE_MAX_MB', 512)) * 1024 ** 2,
+    path=os.environ.get('DOCUMENT_STORE_PATH', os.path.join(CACHE_DIR, 'documents.sqlite3')),
+)
+disk_cache = DiskIndexCache(
+    root=CACHE_DIR,
+    dtype=os.environ.get('EMBEDDINGS_DTYPE', 'float32'),
+)
+index_cache = IndexCache(
+    max_items=int(os.environ.get('INDEX_CACHE_MAX_ITEMS', 32)),
+    max_bytes=int(os.environ.get('INDEX_CACHE_MAX_MB', 2048)) * 1024 ** 2,
+    ttl=float(os.environ.get('INDEX_CACHE_TTL', 3600)),
+)
+text_extractor = TextExtractor(ocr_workers=int(os.environ.get('OCR_WORKERS', 0)) or None)
+llm_client = LLMClient(
+    host=os.environ.get('OLLAMA_HOST') or None,
+    timeout=float(os.environ.get('LLM_TIMEOUT', 120)),
+    max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', 4)),
+    acquire_timeout=float(os.environ.get('LLM_QUEUE_TIMEOUT', 30)),
+    max_retries=int(os.environ.get('LLM_MAX_RETRIES', 2)),
+)
+formatter = AnswerFormatter(client=llm_client)
+corpus_index = CorpusIndex(flat_threshold=int(os.environ.get('CORPUS_FLAT_THRESHOLD', 50_000)),
+                           vector_dtype=VECTOR_DTYPE)
+answer_cache = AnswerCache(
+    max_items=int(os.environ.get('ANSWER_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('ANSWER_CACHE_TTL', 3600)),
+    similarity_threshold=float(os.environ.get('ANSWER_CACHE_THRESHOLD', 0.95)),
+)
+job_manager = JobManager(max_workers=int(os.environ.get('INGEST_WORKERS', 2)))
+# Обновления текста одного документа выполняются по очереди
+update_locks: Dict[str, threading.Lock] = {}
+update_locks_guard = threading.Lock()
+
+
+def release_document(text_id: str) -> None:
+    """Документ удален из хранилища: его индексы больше не нужны."""
+    corpus_index.remove_document(text_id)
+    index_cache.pop(text_id)
+    with update_locks_guard:
+        update_locks.pop(text_id, None)
+
+
+document_store.on_evict = release_document
+# Статусы задач сохраняются в хранилище: с общим sqlite их видят все процессы приложения
+job_manager.on_update = document_store.put_job
+# Документ остается в общем корпусе, пока его индекс в кэше: корпус не держит
+# векторы сверх бюджета INDEX_CACHE_MAX_MB и пополняется по запросам /ask
+index_cache.on_evict = corpus_index.remove_document
+
+# Размеры кэшей и очередей вычисляются при чтении /metrics
+metrics.registry.gauge('rag_documents', 'Документов в хранилище').set_function(
+    lambda: {(): document_store.stats()['documents']})
+metrics.registry.gauge('rag_index_cache_items', 'Индексов в кэше в памяти').set_function(
+    lambda: {(): len(index_cache)})
+metrics.registry.gauge('rag_index_cache_bytes', 'Оценка памяти индексов в кэше, байт').set_function(
+    lambda: {(): index_cache.nbytes})
+metrics.registry.gauge('rag_answer_cache_items', 'Ответов в кэше').set_function(
+    lambda: {(): answer_cache.stats()['size']})
+update_chunks = metrics.registry.counter(
+    'rag_update_chunks_total', 'Чанки при обновлении текста документов: reused, embedded, removed', ['result'])
+
+# Модель эмбеддингов загружается при старте, а не при первом вопросе
+if os.environ.get('EMBEDDING_WARM_UP', '1') == '1':
+    model_registry.warm_up(EMBEDDING_MODEL, EMBEDDING_DEVICE)
+
+
+def build_document_index(text: str, progress=None, chunks=None) -> DocumentIndex:
+    """Загрузка индекса из дискового кэша или построение нового с сохранением на диск.
+    chunks — чанки, уже полученные при потоковом извлечении текста."""
+    document_index = disk_cache.load_index(text, model=EMBEDDING_MODEL, device=EMBEDDING_DEVICE,
+                                           vector_dtype=VECTOR_DTYPE)
+    if document_index is None:
+        document_index = DocumentIndex(text, model=EMBEDDING_MODEL, device=EMBEDDING_DEVICE,
+                                       chunks=chunks, progress=progress, vector_dtype=VECTOR_DTYPE)
+        disk_cache.save_index(document_index)
+    return document_index
+
+
+def get_document_index(text_id: str, text: Optional[str] = None, progress=None,
+                       chunks=None) -> Optional[DocumentIndex]:
+    """Индекс документа из кэша; если он был вытеснен — строится заново.
+    Текст читается из хранилища документов, только если индекс нужно строить;
+    None — документа нет в хранилище."""
+    def build():
+        document_text = text if text is not None else document_store.get_text(text_id)
+        if document_text is None:
+            raise LookupError(text_id)
+        return build_document_index(document_text, progress, chunks)
+
+    try:
+        return index_cache.get_or_build(text_id, build)
+    except LookupError:
+        return None
+
+
+def extract_and_chunk(file_path: str, progress=None, info=None):
+    """Потоковое извлечение текста файла: фрагменты сразу разбиваются на чанки,
+    а текст документа собирается из них одной операцией в конце.
+    В info записываются сведения о файле (число страниц).
+
+    Returns:
+        (текст, чанки в формате DocumentIndex.chunks)
+    """
+    parts = []
+
+    def collect(segments):
+        for segment in segments:
+            parts.append(segment)
+            yield segment
+
+    # Время извлечения текста учитывается отдельно и в этап chunking не входит
+    segments = collect(text_extractor.iter_from_path(file_path, progress, info))
+    text_chunks = list(metrics.timed_iter('chunking', chunk_stream(segments)))
+    return "".join(parts), DocumentIndex.chunk_records(text_chunks)
+
+
+def ingest_text(text_id: str, text: str):
+    """Задача обработки введенного текста: построение индекса.
+    Документ сохраняется в хранилище только после построения индекса: с общим хранилищем
+    sqlite другие процессы считают документ готовым, как только он там появится."""
+    def task(job):
+        get_document_index(text_id, text, job.progress)
+        document_store.put(text_id, text)
+    return task
+
+
+def read_uploaded_file(temp_path: str, progress=None):
+    """Текст загруженного файла; временный файл удаляется.
+    Повторная загрузка того же файла не запускает извлечение текста и OCR.
+
+    Returns:
+        (текст, чанки или None, если текст взят из кэша, сведения о файле)
+    """
+    try:
+        file_hash = disk_cache.file_hash(temp_path)
+        text, chunks = disk_cache.load_text(file_hash), None
+        info = disk_cache.load_text_meta(file_hash) if text is not None else {}
+        if text is None:
+            text, chunks = extract_and_chunk(temp_path, progress, info)
+            disk_cache.save_text(file_hash, text, info)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    if not text:
+        raise ValueError('Не удалось извлечь текст из файла')
+    return text, chunks, info
+
+
+def ingest_file(text_id: str, temp_path: str, filename: Optional[str] = None):
+    """Задача обработки загруженного файла: извлечение текста и построение индекса."""
+    def task(job):
+        text, chunks, info = read_uploaded_file(temp_path, job.progress)
+        get_document_index(text_id, text, job.progress, chunks)
+        # Превью и метаданные вычисляются один раз при загрузке
+        document_store.put(text_id, text, {'pages': info.get('pages'), 'filename': filename})
+    return task
+
+
+def update_document(text_id: str, text: Optional[str] = None, temp_path: Optional[str] = None,
+                    filename: Optional[str] = None, append: bool = False):
+    """Задача обновления текста документа: новый текст (или файл) заменяет прежний
+    или, при append, дописывается в конец. Эмбеддинги неизмененных чанков переиспользуются,
+    векторизуются только новые и измененные. До завершения вопросы отвечаются по прежней версии."""
+    def task(job):
+        chunks, info = None, {}
+        new_text = text
+        if temp_path is not None:
+            new_text, chunks, info = read_uploaded_file(temp_path, job.progress)
+
+        with update_locks_guard:
+            lock = update_locks.setdefault(text_id, threading.Lock())
+        with lock:
+            meta = document_store.get_meta(text_id)
+            current = get_document_index(text_id) if meta is not None else None
+            if current is None:
+                raise ValueError('Документ не найден')
+            if append:
+                new_text, chunks = f"{current.text}\n\n{new_text}", None
+            if new_text == current.text:
+                return
+
+            if append:
+                # Страницы дописанного файла прибавляются к прежним, дописанный текст их не меняет
+                counts = [count for count in (meta.get('pages'), info.get('pages')) if count is not None]
+                pages = sum(counts) if counts else None
+            else:
+                pages = info.get('pages')
+
+            document_index, stats = current.update(new_text, chunks, job.progress)
+            disk_cache.save_index(document_index)
+            document_store.put(text_id, new_text, {
+                'pages': pages,
+                'filename': filename or meta.get('filename'),
+                'created_at': meta.get('created_at'),
+                'updated_at': time.time(),
+            })
+            index_cache.put(text_id, document_index)
+            # В корпусе документ заменяется, только если уже был в него добавлен
+            if text_id in corpus_index:
+                corpus_index.add_index(text_id, document_index)
+            # Ответы по прежней версии текста больше не нужны
+            answer_cache.discard_document(current.text_hash)
+
+        for result in ('reused', 'embedded', 'removed'):
+            update_chunks.inc(stats[result], result=result)
+        app.logger.info(f"Документ {text_id} обновлен: {stats}")
+    return task
+
+
+def track_ingest(task, operation: str = 'ingest'):
+    """Задача обработки документа с учетом в метриках выполняющихся и времени обработки."""
+    def run(job):
+        with metrics.in_flight(operation), metrics.timed(operation):
+            return task(job)
+    return run
+
+
+def read_upload_form():
+    """Текст или файл из формы запроса; файл сохраняется во временный и обрабатывается в фоне.
+
+    Returns:
+        (текст, путь к временному файлу, имя файла) — задан либо текст, либо файл
+    Raises:
+        ValueError: не передан ни текст, ни файл, или формат файла не поддерживается
+    """
+    if 'text' in request.form and request.form['text'].strip():
+        return request.form['text'].strip(), None, None
+
+    file = request.files.get('file')
+    if file is not None and file.filename != '':
+        ext = os.path.splitext(file.filename)[-1].lower()
+        if ext not in text_extractor.supported_extensions:
+            raise ValueError(f'Только {text_extractor.supported_extensions} файлы поддерживаются')
+        with tempfile.NamedTemporaryFile(delete=False, suffix=ext) as temp_file:
+            temp_path = temp_file.name
+        file.save(temp_path)
+        return None, temp_path, file.filename
+
+    raise ValueError('Не предоставлен текст или файл')
+
+
+def get_job_status(job_id: str) -> Optional[Dict]:
+    """Статус задачи обработки: своей задачи процесса или задачи другого процесса из хранилища."""
+    job = job_manager.get(job_id)
+    return job.to_dict() if job else document_store.get_job(job_id)
+
+
+def not_ready_response(text_id: str):
+    """Ответ для документа, который еще обрабатывается или не был обработан; None, если документ готов."""
+    status = get_job_status(text_id)
+    if status is None or status['status'] == READY:
+        return None
+    if status['status'] == FAILED:
+        return jsonify({'error': f'Не удалось обработать документ: {status["error"]}', **status}), 422
+    return jsonify({'error': 'Документ еще обрабатывается', **status}), 409
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    metrics.start_request()
+    metrics.IN_FLIGHT.inc(operation='http_request')
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unknown'
+    metrics.HTTP_REQUESTS.inc(endpoint=endpoint, status=str(response.status_code))
+    metrics.HTTP_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if 'request_start' in g:
+        metrics.IN_FLIGHT.dec(operation='http_request')
 
 
 @app.route('/')
@@ -20,55 +332,216 @@ def index():
 @app.route('/upload', methods=['POST'])
 def upload():
     text_id = str(uuid.uuid4())
-    text_content = ""
+    try:
+        text, temp_path, filename = read_upload_form()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    task = ingest_text(text_id, text) if text is not None else ingest_file(text_id, temp_path, filename)
 
-    if 'file' in request.files:
-        file = request.files['file']
+    # Извлечение текста, разбиение на чанки и векторизация выполняются в фоне один раз
+    job = job_manager.submit(text_id, track_ingest(task))
+    return jsonify({'text_id': text_id, 'status': job.status}), 202
 
-        if file.filename != '':
-            if file.filename.endswith(tuple(text_extractor.supported_extensions)):
-                text_content = text_extractor.extract_from_uploaded_file(file)
-            else:
-                return jsonify({'error': f'Только {text_extractor.supported_extensions} файлы поддерживаются'}), 400
-
-    if 'text' in request.form and request.form['text'].strip():
-        text_content = request.form['text'].strip()
+# Статистика кэшей
+@app.route('/stats')
+def get_stats():
+    return jsonify({'answer_cache': answer_cache.stats(), 'query_batching': query_encoder.stats(),
+                    'document_store': document_store.stats()})
 
-    if not text_content:
-        return jsonify({'error': 'Не предоставлен текст или файл'}), 400
+# Метрики в текстовом формате Prometheus
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-    text_storage[text_id] = text_content
-    return jsonify({'text_id': text_id})
+# Статус обработки документа
+@app.route('/status/<text_id>')
+def get_status(text_id):
+    status = get_job_status(text_id)
+    if status:
+        return jsonify(status)
+    if text_id in document_store:
+        return jsonify({'text_id': text_id, 'status': READY, 'percent': 100})
+    return jsonify({'error': 'Текст не найден'}), 404
 
 # Поиск текста по id
 @app.route('/text/<text_id>')
 def get_text(text_id):
-    text = text_storage.get(text_id)
-    if text:
-        return jsonify({'text': ' '.join(text.split()[:150]) + ('...' if len(text.split()) > 150 else '')})
+    not_ready = not_ready_response(text_id)
+    if not_ready:
+        return not_ready
+
+    meta = document_store.get_meta(text_id)
+    if meta:
+        preview = meta.pop('preview')
+        return jsonify({'text': preview, **meta})
     return jsonify({'error': 'Текст не найден'}), 404
 
+# Обновление текста документа: mode=replace (по умолчанию) заменяет текст, mode=append дописывает
+@app.route('/text/<text_id>', methods=['PUT'])
+def update_text(text_id):
+    not_ready = not_ready_response(text_id)
+    if not_ready:
+        return not_ready
+    if text_id not in document_store:
+        return jsonify({'error': 'Текст не найден'}), 404
+    mode = request.form.get('mode', 'replace')
+    if mode not in ('replace', 'append'):
+        return jsonify({'error': 'mode должен быть replace или append'}), 400
+
+    try:
+        text, temp_path, filename = read_upload_form()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Обновление — отдельная задача со своим идентификатором: пока оно идет,
+    # документ остается доступен для вопросов в прежней версии
+    update_id = str(uuid.uuid4())
+    job = job_manager.submit(update_id, track_ingest(
+        update_document(text_id, text, temp_path, filename, append=mode == 'append'), 'update'))
+    return jsonify({'text_id': text_id, 'update_id': update_id, 'status': job.status}), 202
+
 # Семантический поиск, обработка запроса LLM
 @app.route('/ask', methods=['POST'])
 def ask():
     data = request.json
     text_id = data.get('text_id')
+    # text_ids — вопрос сразу к нескольким загруженным документам
+    text_ids = data.get('text_ids')
     question = data.get('question', '').strip()
 
-    if not text_id or not question:
+    if not (text_id or text_ids) or not question:
         return jsonify({'error': 'Отсутствует text_id или question'}), 400
+    if text_ids is not None and not (isinstance(text_ids, list) and all(isinstance(i, str) for i in text_ids)):
+        return jsonify({'error': 'text_ids должен быть списком идентификаторов'}), 400
 
-    text = text_storage.get(text_id)
-    if not text:
-        return jsonify({'error': 'Текст не найден'}), 404
+    for requested_id in text_ids or [text_id]:
+        not_ready = not_ready_response(requested_id)
+        if not_ready:
+            return not_ready
+        if requested_id not in document_store:
+            return jsonify({'error': 'Текст не найден', 'text_id': requested_id}), 404
+
+    # Параметры поиска задаются для каждого запроса
+    try:
+        top_k = int(data.get('top_k', 5))
+        candidates = int(data.get('candidates', 20))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_k и candidates должны быть целыми числами'}), 400
+    mode = data.get('retrieval', 'hybrid')
+    if mode not in RETRIEVAL_MODES or not 1 <= top_k <= 50 or not 1 <= candidates <= 200:
+        return jsonify({'error': f'Режим поиска — один из {RETRIEVAL_MODES}, top_k от 1 до 50, '
+                                 f'candidates от 1 до 200'}), 400
+
+    if text_ids:
+        # Документ мог быть загружен другим процессом приложения (общее хранилище sqlite)
+        # или удален из корпуса вместе с вытеснением индекса; обращение к кэшу индексов
+        # обновляет LRU, чтобы документы запроса не вытесняли друг друга
+        for requested_id in text_ids:
+            requested_index = get_document_index(requested_id)
+            if requested_index is None:
+                return jsonify({'error': 'Текст не найден', 'text_id': requested_id}), 404
+            if requested_id not in corpus_index:
+                corpus_index.add_index(requested_id, requested_index)
+        if not all(requested_id in corpus_index for requested_id in text_ids):
+            return jsonify({'error': 'Индексы документов не помещаются в кэш одновременно, '
+                                     'уменьшите число документов в text_ids'}), 400
+        document_index = corpus_index.view(text_ids)
+    else:
+        document_index = get_document_index(text_id)
+        if document_index is None:
+            return jsonify({'error': 'Текст не найден', 'text_id': text_id}), 404
+    found_context = SemanticSearch(None, question, index=document_index, top_k=top_k, mode=mode,
+                                   candidates=candidates, rerank=bool(data.get('rerank')),
+                                   reranker_model=RERANKER_MODEL, device=EMBEDDING_DEVICE)
+    context = found_context.context_preparation(CONTEXT_TOKEN_BUDGET)
+    app.logger.info(f"Этапы поиска, мс: {found_context.timings}")
+    app.logger.info(f"Контекст: {found_context.context_stats}")
+
+    # Повторные и почти совпадающие вопросы к тому же документу отвечаются из кэша;
+    # no_cache отключает кэш для запроса
+    use_cache = not (request.args.get('no_cache') == '1' or data.get('no_cache'))
+    chunk_ids = [(res.get('text_id', text_id), res['position']) for res in found_context.results]
+    cache_args = (document_index.text_hash, question, chunk_ids)
+    cached_answer, cache_hit = None, None
+    if use_cache:
+        cached_answer, cache_hit = answer_cache.get(*cache_args, query_embedding=found_context.question_embedding)
+
+    def save_answer(answer_text):
+        if use_cache:
+            answer_cache.put(*cache_args, answer_text, query_embedding=found_context.question_embedding)
+
+    if request.args.get('stream') == '1' or data.get('stream'):
+        return stream_answer(question, context, cached_answer, save_answer)
+
+    def debug_info():
+        """Отладочные сведения запроса: этапы поиска, сборка контекста и время всех этапов, мс."""
+        if not data.get('debug'):
+            return {}
+        timings = {stage: round(ms, 3) for stage, ms in metrics.request_timings().items()}
+        timings['total'] = round((time.perf_counter() - g.request_start) * 1000, 3)
+        return {'retrieval_timings': found_context.timings, 'context': found_context.context_stats,
+                'timings': timings}
+
+    if cached_answer is not None:
+        return jsonify({'answer': cached_answer, 'cached': cache_hit, **debug_info()})
+
+    try:
+        answer_text = formatter.generate_answer(question, context)
+    except LLMError as e:
+        return llm_error_response(e)
+    save_answer(answer_text)
+    return jsonify({'answer': answer_text, **debug_info()})
+
+
+def llm_error_status(error: Exception):
+    """Сообщение и HTTP-код для ошибки генерации ответа."""
+    app.logger.error(f"Ошибка при генерации ответа: {str(error)}")
+    if isinstance(error, LLMBusyError):
+        return 'Сервис перегружен, повторите запрос позже', 503
+    if isinstance(error, LLMTimeoutError):
+        return 'Превышено время ожидания ответа модели', 504
+    return 'Ошибка при генерации ответа', 502
+
+
+def llm_error_response(error: LLMError):
+    """JSON-ответ с кодом, соответствующим ошибке LLM."""
+    message, status = llm_error_status(error)
+    return jsonify({'error': message}), status
+
+
+def sse_event(data: dict, event: str = None) -> str:
+    """Форматирование события server-sent events."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_answer(question: str, context: str, cached_answer: str = None, on_complete=None) -> Response:
+    """Потоковая передача ответа LLM по токенам через server-sent events.
+    Ответ из кэша передается одним событием; полный сгенерированный ответ передается в on_complete."""
+    def generate():
+        try:
+            if cached_answer is not None:
+                yield sse_event({'token': cached_answer, 'cached': True})
+                yield sse_event({}, event='done')
+                return
 
-    found_context = SemanticSearch(text, question)
-    context = found_context.context_preparation()
-    
+            tokens = []
+            for token in formatter.stream_answer(question, context):
+                tokens.append(token)
+                yield sse_event({'token': token})
+            if on_complete:
+                on_complete(''.join(tokens))
+            yield sse_event({}, event='done')
+        except Exception as e:
+            message, _ = llm_error_status(e)
+            yield sse_event({'error': message}, event='error')
 
-    answer_text = formatter.generate_answer(question, context)
-    return jsonify({'answer': answer_text})
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    # Процессы OCR (forkserver/spawn) импортируют главный модуль по его __file__ заново:
+    # без него они не загружают модели и состояние приложения, а только модуль ocr_worker
+    main_file = globals().pop('__file__')
+    app.run(debug=True, port=5000, extra_files=[main_file])
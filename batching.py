@@ -0,0 +1,161 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import Future
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import metrics
+from embeddings import model_registry
+
+logger = logging.getLogger(__name__)
+
+# Границы гистограммы размеров батчей: степени двойки до максимального размера по умолчанию
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class _Request(NamedTuple):
+    model_key: Tuple[str, Optional[str], Optional[str]]
+    query: str
+    future: Future
+    enqueued: float
+
+
+class BatchingEncoder:
+    """Векторизация вопросов одновременных запросов общими батчами.
+
+    Вопросы попадают в очередь, фоновый поток забирает все ожидающие и кодирует их
+    одним вызовом model.encode с prompt_name="search_query". Одиночный вопрос
+    кодируется сразу; если в очереди ждали и другие, поток добирает батч еще
+    window_ms миллисекунд после первого (или пока не наберется max_batch).
+    Вопросы к разным моделям кодируются отдельно. Пока идет кодирование, новые
+    вопросы копятся в очереди и попадают в следующий батч.
+
+    Args:
+        window_ms: сколько добирать батч после первого вопроса, если вопросы ждут в очереди, мс
+        max_batch: максимальный размер батча
+    """
+
+    def __init__(self, window_ms: float = 5.0, max_batch: int = 32):
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queries = 0
+        self._errors = 0
+        self._wait_ms = 0.0
+        self._max_queue_depth = 0
+
+    def encode(self, query: str, model_name: str, device: Optional[str] = None,
+               backend: Optional[str] = None) -> np.ndarray:
+        """Эмбеддинг вопроса; вызывающий поток ждет, пока будет обработан его батч."""
+        self._ensure_worker()
+        future = Future()
+        model_key = (model_name, device or model_registry.device, backend or model_registry.backend)
+        self._queue.put(_Request(model_key, query, future, time.perf_counter()))
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._max_queue_depth = max(self._max_queue_depth, depth)
+        return future.result()
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_depth': self._max_queue_depth,
+                'queries': self._queries,
+                'batches': batches,
+                'errors': self._errors,
+                'avg_batch_size': self._queries / batches if batches else 0.0,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+                'avg_wait_ms': self._wait_ms / self._queries if self._queries else 0.0,
+                'window_ms': self.window_ms,
+                'max_batch': self.max_batch,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='query-batching', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.perf_counter() + self.window_ms / 1000
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    # Одиночный вопрос не ждет окна: ждать имеет смысл, только когда идет поток вопросов
+                    if len(batch) == 1 or remaining <= 0:
+                        break
+                    try:
+                        request = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+            self._encode_batch(batch)
+            if stop:
+                return
+
+    def _encode_batch(self, batch: List[_Request]) -> None:
+        started = time.perf_counter()
+        groups: Dict[Tuple, List[_Request]] = defaultdict(list)
+        for request in batch:
+            groups[request.model_key].append(request)
+
+        errors = 0
+        for model_key, requests in groups.items():
+            try:
+                model = model_registry.get(*model_key)
+                with metrics.timed('query_embedding_batch'):
+                    vectors = model.encode([request.query for request in requests], prompt_name="search_query",
+                                           batch_size=len(requests), convert_to_numpy=True)
+                for request, vector in zip(requests, vectors):
+                    request.future.set_result(vector)
+            except Exception as e:
+                logger.error(f"Ошибка при векторизации батча вопросов: {str(e)}")
+                errors += len(requests)
+                for request in requests:
+                    request.future.set_exception(e)
+
+        with self._stats_lock:
+            for requests in groups.values():
+                self._batch_sizes[len(requests)] += 1
+                BATCH_SIZE.observe(len(requests))
+            self._queries += len(batch)
+            self._errors += errors
+            self._wait_ms += sum((started - request.enqueued) * 1000 for request in batch)
+
+
+BATCH_SIZE = metrics.registry.histogram(
+    'rag_query_batch_size', 'Размер батчей векторизации вопросов', buckets=BATCH_SIZE_BUCKETS)
+
+query_encoder = BatchingEncoder()
+metrics.registry.gauge('rag_query_queue_depth', 'Вопросов в очереди векторизации').set_function(
+    lambda: {(): query_encoder.stats()['queue_depth']})
@@ -0,0 +1,100 @@
+"""
+Полнота и задержка поиска CorpusIndex на синтетическом корпусе.
+
+Эмбеддинги генерируются как смесь гауссовых кластеров (ближе к реальным текстам, чем
+равномерный шум), модель не загружается. Для каждого размера корпуса измеряются время
+построения, задержка запроса (p50/p95) по всему корпусу и с фильтром по 10% документов,
+а также recall@k относительно точного поиска. Запуск из корня проекта:
+    python benchmarks/bench_corpus.py --sizes 10000 100000
+    python benchmarks/bench_corpus.py --sizes 1000000 --dim 256
+"""
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import CorpusIndex  # noqa: E402
+
+
+def make_vectors(rng, n: int, dim: int, clusters: int = 200) -> np.ndarray:
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, clusters, n)
+    return centers[labels] + 0.5 * rng.standard_normal((n, dim), dtype=np.float32)
+
+
+def percentile_ms(samples, q: float) -> float:
+    return float(np.percentile(samples, q) * 1000)
+
+
+def bench(size: int, args, rng) -> dict:
+    vectors = make_vectors(rng, size, args.dim)
+    queries = vectors[rng.choice(size, args.queries, replace=False)] \
+        + 0.1 * rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+    doc_count = max(1, size // args.doc_size)
+
+    corpus = CorpusIndex(flat_threshold=args.flat_threshold, nprobe=args.nprobe)
+    start = time.perf_counter()
+    for doc in range(doc_count):
+        part = vectors[doc * args.doc_size:(doc + 1) * args.doc_size]
+        positions = np.arange(len(part))
+        corpus.add_document(f'doc-{doc}', part, [''] * len(part), positions, np.zeros(len(part)))
+    build_time = time.perf_counter() - start
+
+    # Точный поиск для оценки полноты
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(vectors[:doc_count * args.doc_size])
+    _, exact_ids = exact.search(queries, args.top_k)
+
+    latencies, recalls = [], []
+    for query, truth in zip(queries, exact_ids):
+        start = time.perf_counter()
+        results = corpus.search(query, args.top_k)
+        latencies.append(time.perf_counter() - start)
+        found = {int(r['text_id'].split('-')[1]) * args.doc_size + r['position'] for r in results}
+        recalls.append(len(found & set(truth.tolist())) / args.top_k)
+
+    subset = [f'doc-{doc}' for doc in range(0, doc_count, 10)]
+    filtered = []
+    for query in queries:
+        start = time.perf_counter()
+        corpus.search(query, args.top_k, text_ids=subset)
+        filtered.append(time.perf_counter() - start)
+
+    return {
+        'size': size,
+        'index': corpus.index_type,
+        'build_s': build_time,
+        'p50_ms': percentile_ms(latencies, 50),
+        'p95_ms': percentile_ms(latencies, 95),
+        'filtered_p50_ms': percentile_ms(filtered, 50),
+        'recall': float(np.mean(recalls)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--doc-size', type=int, default=1000, help='чанков в одном документе')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--flat-threshold', type=int, default=50_000)
+    parser.add_argument('--nprobe', type=int, default=16)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'векторов':>10}{'индекс':>8}{'построение, с':>15}{'p50, мс':>10}{'p95, мс':>10}"
+          f"{'фильтр p50, мс':>16}{f'recall@{args.top_k}':>12}")
+    for size in args.sizes:
+        row = bench(size, args, rng)
+        print(f"{row['size']:>10}{row['index']:>8}{row['build_s']:>15.2f}{row['p50_ms']:>10.2f}"
+              f"{row['p95_ms']:>10.2f}{row['filtered_p50_ms']:>16.2f}{row['recall']:>12.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,478 @@
+"""
+Сквозной бенчмарк приложения: извлечение текста, индексация, поиск и эндпоинты Flask
+(через тестовый клиент) с локальной заглушкой Ollama вместо LLM.
+
+Генерируются синтетические русско-английские документы заданного размера (TXT и DOCX),
+PDF с текстовым слоем и изображения страниц. В PDF и на изображениях текст английский:
+стандартные шрифты PDF и шрифт PIL по умолчанию не содержат кириллицы. Изображения
+распознаются, только если установлен tesseract, иначе формат пропускается.
+Для каждого этапа выводятся пропускная способность, задержки p50/p95/p99 и пиковый объем
+памяти процесса (RSS) во время этапа; результаты вместе с параметрами запуска и временем
+внутренних этапов приложения (метрики rag_stage_seconds) сохраняются в JSON для сравнения
+запусков. Генерация документов и вопросов детерминирована (--seed). Запуск из корня проекта:
+    python benchmarks/bench_e2e.py --sizes 20 200 --questions 50
+    python benchmarks/bench_e2e.py --model path/to/small-model --concurrency 4 --output e2e.json
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embeddings import DEFAULT_MODEL, EMBEDDING_BACKENDS  # noqa: E402
+from searching import RETRIEVAL_MODES  # noqa: E402
+from stub_ollama import start_stub_server  # noqa: E402
+
+# Предложения документов и вопросы к ним; {n} — случайное число
+SENTENCES_RU = [
+    ("Арендатор обязан вносить арендную плату не позднее {n} числа каждого месяца.",
+     "До какого числа нужно вносить арендную плату?"),
+    ("Штраф за просрочку составляет {n}% от суммы задолженности за каждый день.",
+     "Какой штраф за просрочку платежа?"),
+    ("Гарантийный срок на оборудование составляет {n} месяцев с даты поставки.",
+     "Какой гарантийный срок на оборудование?"),
+    ("Стороны обязуются соблюдать конфиденциальность в течение {n} лет.",
+     "Сколько лет действует обязательство о конфиденциальности?"),
+    ("Договор вступает в силу с момента подписания и действует {n} месяцев.",
+     "Когда договор вступает в силу?"),
+]
+SENTENCES_EN = [
+    ("The supplier shall deliver the goods within {n} business days after payment.",
+     "When must the supplier deliver the goods?"),
+    ("Either party may terminate this agreement with {n} days written notice.",
+     "How can the agreement be terminated?"),
+    ("All disputes shall be resolved by arbitration in accordance with clause {n}.",
+     "How are disputes resolved?"),
+    ("The buyer shall inspect the goods within {n} hours of delivery.",
+     "How long does the buyer have to inspect the goods?"),
+    ("Invoices are payable within {n} days from the date of issue.",
+     "When are invoices payable?"),
+]
+SENTENCES_PER_PARAGRAPH = 6
+PDF_LINE_CHARS = 90
+PDF_LINES_PER_PAGE = 50
+IMAGE_CHARS = 1500
+
+
+def make_text(rng, chars: int, sentences) -> str:
+    """Текст не короче chars символов из случайных предложений, абзацы разделены пустой строкой."""
+    paragraphs, sentence_buffer, length = [], [], 0
+    while length < chars:
+        template = sentences[int(rng.integers(len(sentences)))][0]
+        sentence = template.format(n=int(rng.integers(1, 1000)))
+        sentence_buffer.append(sentence)
+        length += len(sentence) + 1
+        if len(sentence_buffer) == SENTENCES_PER_PARAGRAPH:
+            paragraphs.append(' '.join(sentence_buffer))
+            sentence_buffer = []
+    if sentence_buffer:
+        paragraphs.append(' '.join(sentence_buffer))
+    return '\n\n'.join(paragraphs)
+
+
+def wrap_lines(text: str, width: int) -> List[str]:
+    lines = []
+    for paragraph in text.split('\n\n'):
+        line = ''
+        for word in paragraph.split():
+            if line and len(line) + 1 + len(word) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = f'{line} {word}' if line else word
+        lines.extend([line, ''])
+    return lines
+
+
+def make_pdf(text: str) -> bytes:
+    """Минимальный PDF с текстовым слоем (шрифт Helvetica, только латиница)."""
+    lines = wrap_lines(text, PDF_LINE_CHARS)
+    pages = [lines[i:i + PDF_LINES_PER_PAGE] for i in range(0, len(lines), PDF_LINES_PER_PAGE)]
+    font_id = 3 + 2 * len(pages)
+    kids = ' '.join(f'{3 + 2 * i} 0 R' for i in range(len(pages)))
+    objects = ['<< /Type /Catalog /Pages 2 0 R >>',
+               f'<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>']
+    for i, page in enumerate(pages):
+        objects.append(f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R '
+                       f'/Resources << /Font << /F1 {font_id} 0 R >> >> >>')
+        escaped = (line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') for line in page)
+        stream = 'BT /F1 10 Tf 14 TL 50 750 Td ' + ' '.join(f'({line}) Tj T*' for line in escaped) + ' ET'
+        objects.append(f'<< /Length {len(stream)} >>\nstream\n{stream}\nendstream')
+    objects.append('<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f'{number} 0 obj\n{obj}\nendobj\n'.encode('latin-1'))
+    xref = out.tell()
+    out.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode())
+    for offset in offsets:
+        out.write(f'{offset:010d} 00000 n \n'.encode())
+    out.write(f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'.encode())
+    return out.getvalue()
+
+
+def make_docx(text: str, path: str) -> None:
+    from docx import Document
+
+    document = Document()
+    for paragraph in text.split('\n\n'):
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def make_image(text: str, path: str) -> None:
+    """Страница A4 при 150 dpi с началом текста."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    try:
+        font = ImageFont.load_default(size=24)
+    except TypeError:
+        # Pillow < 10.1: растровый шрифт без выбора размера
+        font = ImageFont.load_default()
+    image = Image.new('L', (1240, 1754), 255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(wrap_lines(text[:IMAGE_CHARS], 80)):
+        draw.text((60, 60 + i * 34), line, fill=0, font=font)
+    image.save(path)
+
+
+def make_documents(args, rng, workdir: str) -> List[Dict]:
+    """Файлы документов всех форматов для каждого размера."""
+    documents = []
+    for size in args.sizes:
+        chars = size * 1000
+        mixed = make_text(rng, chars, SENTENCES_RU + SENTENCES_EN)
+        english = make_text(rng, chars, SENTENCES_EN)
+        for fmt in args.formats:
+            path = os.path.join(workdir, f'doc-{size}k.{fmt}')
+            if fmt == 'txt':
+                with open(path, 'w', encoding='utf-8') as file:
+                    file.write(mixed)
+            elif fmt == 'docx':
+                make_docx(mixed, path)
+            elif fmt == 'pdf':
+                with open(path, 'wb') as file:
+                    file.write(make_pdf(english))
+            elif fmt == 'png':
+                make_image(english, path)
+            documents.append({'format': fmt, 'size_k': size, 'path': path, 'bytes': os.path.getsize(path)})
+    return documents
+
+
+def make_questions(rng, count: int) -> List[str]:
+    questions = [question for _, question in SENTENCES_RU + SENTENCES_EN]
+    return [questions[int(i)] for i in rng.integers(0, len(questions), count)]
+
+
+def rss_mb() -> float:
+    """Текущий объем резидентной памяти процесса (пиковый, если /proc недоступен)."""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PeakRSS:
+    """Пиковый RSS за время этапа: фоновый поток опрашивает объем памяти процесса."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak_mb = rss_mb()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, rss_mb())
+
+    def _poll(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, rss_mb())
+
+
+def summarize(stage: str, unit: str, latencies: List[float], items: float, wall: float,
+              peak_rss_mb: float, errors: List[str]) -> Dict:
+    samples = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        'stage': stage,
+        'n': len(latencies),
+        'errors': len(errors),
+        'error': errors[0] if errors else None,
+        'unit': unit,
+        'throughput': items / wall if wall > 0 else 0.0,
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'mean_ms': float(samples.mean()),
+        'wall_s': wall,
+        'peak_rss_mb': peak_rss_mb,
+    }
+
+
+def run_stage(stage: str, unit: str, jobs: list, function: Callable, concurrency: int = 1,
+              extra: Optional[Dict[str, List[float]]] = None) -> List[Dict]:
+    """Выполнение function(job) для всех заданий; function возвращает число обработанных единиц unit.
+    В extra function может записать дополнительные задержки (например, время до первого токена)
+    — они выводятся отдельными этапами с тем же временем и памятью."""
+    latencies, errors, items = [], [], [0.0]
+    lock = threading.Lock()
+
+    def run(job):
+        start = time.perf_counter()
+        try:
+            count = function(job)
+        except Exception as e:
+            with lock:
+                errors.append(f'{type(e).__name__}: {e}')
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            items[0] += count
+
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(run, jobs))
+        else:
+            for job in jobs:
+                run(job)
+        wall = time.perf_counter() - start
+
+    rows = [summarize(stage, unit, latencies, items[0], wall, rss.peak_mb, errors)]
+    for name, samples in (extra or {}).items():
+        rows.append(summarize(name, 'запросов', samples, len(samples), wall, rss.peak_mb, []))
+    for row in rows:
+        print_row(row)
+    return rows
+
+
+def print_header() -> None:
+    print(f"{'этап':<30}{'n':>6}{'ошибок':>8}{'в секунду':>14}{'p50, мс':>10}{'p95, мс':>10}"
+          f"{'p99, мс':>10}{'RSS, МБ':>10}  единицы")
+
+
+def print_row(row: Dict) -> None:
+    print(f"{row['stage']:<30}{row['n']:>6}{row['errors']:>8}{row['throughput']:>14.1f}{row['p50_ms']:>10.1f}"
+          f"{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['peak_rss_mb']:>10.0f}  {row['unit']}")
+    if row['error']:
+        print(f"{'':<30}первая ошибка: {row['error']}")
+
+
+def wait_ready(client, text_id: str, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        status = client.get(f'/status/{text_id}').get_json()
+        if status.get('status') == 'ready':
+            return
+        if status.get('status') == 'failed':
+            raise RuntimeError(f"Документ не обработан: {status.get('error')}")
+        time.sleep(0.005)
+    raise TimeoutError(f'Документ {text_id} не обработан за {timeout} с')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--backend', default='torch', choices=EMBEDDING_BACKENDS)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 200], help='размеры документов, тысяч символов')
+    parser.add_argument('--formats', nargs='+', default=['txt', 'docx', 'pdf', 'png'],
+                        choices=['txt', 'docx', 'pdf', 'png'])
+    parser.add_argument('--questions', type=int, default=50, help='вопросов к каждому документу')
+    parser.add_argument('--concurrency', type=int, default=1, help='одновременных запросов на этапах поиска и HTTP')
+    parser.add_argument('--retrieval', default='hybrid', choices=RETRIEVAL_MODES)
+    parser.add_argument('--rerank', action='store_true')
+    parser.add_argument('--first-token-delay', type=float, default=0.0, help='задержка заглушки LLM, с')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='задержка заглушки LLM на токен, с')
+    parser.add_argument('--timeout', type=float, default=600.0, help='время ожидания обработки документа, с')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='файл для результатов в JSON')
+    parser.add_argument('--keep-files', action='store_true', help='не удалять сгенерированные документы')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    workdir = tempfile.mkdtemp(prefix='bench-e2e-')
+    stub = start_stub_server(first_token_delay=args.first_token_delay, token_delay=args.token_delay)
+
+    # Настройки приложения читаются при импорте app; кэши — во временном каталоге,
+    # чтобы результаты прошлых запусков не влияли на измерения
+    os.environ.update({
+        'EMBEDDING_MODEL': args.model,
+        'EMBEDDING_BACKEND': args.backend,
+        'EMBEDDING_WARM_UP': '0',
+        'OLLAMA_HOST': f'http://127.0.0.1:{stub.server_address[1]}',
+        'CACHE_DIR': os.path.join(workdir, 'cache'),
+        'DOCUMENT_STORE': 'memory',
+    })
+    import app as web
+    import metrics
+    from searching import DocumentIndex, SemanticSearch
+
+    logging.getLogger().setLevel(logging.WARNING)
+    web.app.logger.setLevel(logging.WARNING)
+
+    formats = list(args.formats)
+    skipped = {}
+    if 'png' in formats and shutil.which('tesseract') is None:
+        formats.remove('png')
+        skipped['png'] = 'tesseract не установлен'
+        print('Изображения пропущены: tesseract не установлен')
+    args.formats = formats
+
+    try:
+        documents = make_documents(args, rng, workdir)
+        questions = make_questions(rng, args.questions)
+        print(f"Документов: {len(documents)}, вопросов к документу: {len(questions)}, модель: {args.model}, "
+              f"бэкенд: {args.backend}, одновременных запросов: {args.concurrency}\n")
+        print_header()
+        stages = []
+
+        stages += run_stage('model_load', 'моделей', [args.model],
+                            lambda model: web.model_registry.warm_up(model) or 1)
+
+        texts = {}
+        for fmt in formats:
+            def extract(document):
+                text = web.text_extractor.extract_from_path(document['path'])
+                texts[(document['format'], document['size_k'])] = text
+                return len(text)
+            stages += run_stage(f'extract_{fmt}', 'символов',
+                                [document for document in documents if document['format'] == fmt], extract)
+        for document in documents:
+            document['chars'] = len(texts.get((document['format'], document['size_k']), ''))
+
+        indexes = []
+
+        def build_index(text):
+            index = DocumentIndex(text, model=args.model, vector_dtype=web.VECTOR_DTYPE,
+                                  progress=lambda stage, done, total: None)
+            indexes.append(index)
+            return len(index.chunks)
+        index_texts = [text for (fmt, _), text in sorted(texts.items()) if fmt == 'txt'] \
+            or list(texts.values())[:1]
+        stages += run_stage('index', 'чанков', index_texts, build_index)
+
+        def search(job):
+            index, question = job
+            SemanticSearch(None, question, index=index, mode=args.retrieval, rerank=args.rerank,
+                           reranker_model=web.RERANKER_MODEL).context_preparation(web.CONTEXT_TOKEN_BUDGET)
+            return 1
+        stages += run_stage('search', 'запросов', [(index, q) for index in indexes for q in questions],
+                            search, args.concurrency)
+
+        text_ids = []
+
+        def upload(document):
+            client = web.app.test_client()
+            with open(document['path'], 'rb') as file:
+                response = client.post('/upload', data={'file': (file, os.path.basename(document['path']))},
+                                       content_type='multipart/form-data')
+            if response.status_code != 202:
+                raise RuntimeError(response.get_json().get('error'))
+            text_id = response.get_json()['text_id']
+            wait_ready(client, text_id, args.timeout)
+            text_ids.append(text_id)
+            return 1
+        stages += run_stage('http_upload', 'документов', documents, upload, args.concurrency)
+
+        def ask(job, **params):
+            text_id, question = job
+            response = web.app.test_client().post('/ask', json={
+                'text_id': text_id, 'question': question, 'retrieval': args.retrieval,
+                'rerank': args.rerank, **params})
+            if response.status_code != 200:
+                raise RuntimeError(f"{response.status_code}: {response.get_json().get('error')}")
+            return 1
+        ask_jobs = [(text_id, q) for text_id in text_ids for q in questions]
+        stages += run_stage('http_ask', 'запросов', ask_jobs, lambda job: ask(job, no_cache=True),
+                            args.concurrency)
+
+        # Первый проход заполняет кэш ответов, измеряется повторный
+        for job in ask_jobs:
+            ask(job)
+        stages += run_stage('http_ask_cached', 'запросов', ask_jobs, ask, args.concurrency)
+
+        first_token = []
+
+        def ask_stream(job):
+            text_id, question = job
+            start = time.perf_counter()
+            response = web.app.test_client().post('/ask', json={
+                'text_id': text_id, 'question': question, 'retrieval': args.retrieval,
+                'rerank': args.rerank, 'no_cache': True, 'stream': True}, buffered=False)
+            try:
+                first = True
+                for event in response.response:
+                    if first:
+                        first_token.append(time.perf_counter() - start)
+                        first = False
+                    if b'event: error' in event:
+                        raise RuntimeError(event.decode('utf-8').strip())
+            finally:
+                response.close()
+            return 1
+        stages += run_stage('http_ask_stream', 'запросов', ask_jobs, ask_stream, args.concurrency,
+                            extra={'http_ask_stream_first_token': first_token})
+
+        app_stages = {
+            key[0]: {'count': summary['count'], 'total_s': summary['sum'],
+                     'mean_ms': summary['sum'] / summary['count'] * 1000 if summary['count'] else 0.0}
+            for key, summary in sorted(metrics.STAGE_SECONDS.summaries().items())
+        }
+        results = {
+            'config': vars(args),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'numpy': np.__version__,
+            },
+            'skipped_formats': skipped,
+            'documents': [{key: value for key, value in document.items() if key != 'path'}
+                          for document in documents],
+            'stages': stages,
+            'app_stages': app_stages,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as file:
+                json.dump(results, file, ensure_ascii=False, indent=2)
+            print(f"\nРезультаты сохранены в {args.output}")
+    finally:
+        stub.shutdown()
+        if args.keep_files:
+            print(f"Документы: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Скорость векторизации и качество поиска для бэкендов модели эмбеддингов.
+
+Для каждого бэкенда (torch, onnx, onnx-int8) измеряются время загрузки модели,
+пропускная способность векторизации чанков (чанков/с), прирост памяти процесса
+и совпадение top-k поиска с базовым вариантом torch fp32 на одном и том же корпусе.
+Отдельно для базовых эмбеддингов сравниваются типы хранения векторов в FAISS
+(float32, float16, int8): байт на вектор и совпадение top-k с float32.
+Корпус — текстовый файл (--text) или синтетический русско-английский текст. Запуск из корня проекта:
+    python benchmarks/bench_embeddings.py --chunks 2000
+    python benchmarks/bench_embeddings.py --text examples/doc.txt --threads 4 --max-seq-length 256
+"""
+import argparse
+import gc
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embeddings import DEFAULT_MODEL, EMBEDDING_BACKENDS, ModelRegistry  # noqa: E402
+from searching import VECTOR_DTYPES, chunk_stream, make_flat_index  # noqa: E402
+
+SENTENCES = [
+    "Арендатор обязан вносить арендную плату не позднее {n} числа каждого месяца.",
+    "Договор вступает в силу с момента подписания и действует {n} месяцев.",
+    "The supplier shall deliver the goods within {n} business days after payment.",
+    "Штраф за просрочку составляет {n}% от суммы задолженности за каждый день.",
+    "Either party may terminate this agreement with {n} days written notice.",
+    "Стороны обязуются соблюдать конфиденциальность в течение {n} лет.",
+    "Гарантийный срок на оборудование составляет {n} месяцев с даты поставки.",
+    "All disputes shall be resolved by arbitration in accordance with clause {n}.",
+]
+
+
+def sample_corpus(args, rng) -> list:
+    if args.text:
+        with open(args.text, encoding='utf-8') as file:
+            chunks = list(chunk_stream(iter(lambda: file.read(1024 * 1024), '')))
+    else:
+        # Около 7 предложений в чанке по 500 символов
+        sentences = (SENTENCES[int(i)].format(n=int(n)) + ' '
+                     for i, n in zip(rng.integers(0, len(SENTENCES), args.chunks * 8),
+                                     rng.integers(1, 1000, args.chunks * 8)))
+        chunks = list(chunk_stream(sentences))
+    return chunks[:args.chunks]
+
+
+def rss_mb() -> float:
+    """Текущий объем резидентной памяти процесса (пиковый, если /proc недоступен)."""
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def top_k_ids(vectors: np.ndarray, queries: np.ndarray, top_k: int, vector_dtype: str = 'float32') -> np.ndarray:
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    index = make_flat_index(vectors.shape[1], vector_dtype)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    _, ids = index.search(np.ascontiguousarray(queries, dtype='float32'), top_k)
+    return ids
+
+
+def agreement(ids: np.ndarray, baseline: np.ndarray) -> float:
+    """Средняя доля общих результатов top-k с базовым вариантом."""
+    return float(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(ids.tolist(), baseline.tolist())]))
+
+
+def bench_backend(backend: str, chunks: list, queries: list, args) -> dict:
+    registry = ModelRegistry(backend=backend, batch_size=args.batch_size, threads=args.threads,
+                             max_seq_length=args.max_seq_length, onnx_dir=args.onnx_dir,
+                             quantization=args.quantization)
+    gc.collect()
+    memory_before = rss_mb()
+    start = time.perf_counter()
+    model = registry.get(args.model)
+    load_time = time.perf_counter() - start
+
+    model.encode(chunks[:args.batch_size], prompt_name="search_document", batch_size=args.batch_size)
+    start = time.perf_counter()
+    embeddings = model.encode(chunks, prompt_name="search_document", batch_size=args.batch_size,
+                              convert_to_numpy=True)
+    encode_time = time.perf_counter() - start
+    query_embeddings = model.encode(queries, prompt_name="search_query", batch_size=args.batch_size,
+                                    convert_to_numpy=True)
+    memory = rss_mb() - memory_before
+
+    registry.clear()
+    del model
+    gc.collect()
+    return {
+        'backend': backend,
+        'load_s': load_time,
+        'chunks_per_s': len(chunks) / encode_time,
+        'memory_mb': memory,
+        'embeddings': embeddings,
+        'queries': query_embeddings,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--backends', nargs='+', default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument('--text', help='текстовый файл для корпуса (UTF-8)')
+    parser.add_argument('--chunks', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--max-seq-length', type=int)
+    parser.add_argument('--quantization', default='avx2', choices=['avx2', 'avx512', 'avx512_vnni', 'arm64'])
+    parser.add_argument('--onnx-dir', default=os.path.join('.cache', 'onnx'))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    chunks = sample_corpus(args, rng)
+    # Запросы — начало случайных чанков, ответом на запрос считаются ближайшие чанки
+    queries = [chunks[i][:120] for i in rng.choice(len(chunks), min(args.queries, len(chunks)), replace=False)]
+    print(f"Корпус: {len(chunks)} чанков, запросов: {len(queries)}, модель: {args.model}")
+
+    # Базовый вариант — torch fp32, даже если он не указан в --backends
+    backends = ['torch'] + [backend for backend in args.backends if backend != 'torch']
+    rows = [bench_backend(backend, chunks, queries, args) for backend in backends]
+    baseline = top_k_ids(rows[0]['embeddings'], rows[0]['queries'], args.top_k)
+
+    print(f"{'бэкенд':>10}{'загрузка, с':>13}{'чанков/с':>11}{'память, МБ':>12}{f'top-{args.top_k} с fp32':>15}")
+    for row in rows:
+        if row['backend'] not in args.backends:
+            continue
+        ids = top_k_ids(row['embeddings'], row['queries'], args.top_k)
+        print(f"{row['backend']:>10}{row['load_s']:>13.2f}{row['chunks_per_s']:>11.1f}"
+              f"{row['memory_mb']:>12.0f}{agreement(ids, baseline):>15.3f}")
+
+    print(f"\n{'векторы':>10}{'байт/вектор':>13}{f'top-{args.top_k} с float32':>18}")
+    dim = rows[0]['embeddings'].shape[1]
+    for vector_dtype in VECTOR_DTYPES:
+        ids = top_k_ids(rows[0]['embeddings'], rows[0]['queries'], args.top_k, vector_dtype)
+        print(f"{vector_dtype:>10}{make_flat_index(dim, vector_dtype).code_size:>13}{agreement(ids, baseline):>18.3f}")
+
+
+if __name__ == '__main__':
+    main()
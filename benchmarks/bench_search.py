@@ -0,0 +1,94 @@
+"""
+Сравнение построения индекса и поиска: прежний путь pandas → datasets.Dataset → add_faiss_index
+и DocumentIndex на NumPy/FAISS.
+
+Эмбеддинги генерируются случайно, модель не загружается, поэтому измеряется только
+накладная стоимость хранения векторов и поиска. Для прежнего пути нужны pandas и datasets:
+    pip install pandas datasets
+Запуск из корня проекта:
+    python benchmarks/bench_search.py --chunks 1000 10000 --queries 200
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from searching import DocumentIndex  # noqa: E402
+
+
+def make_chunks(n: int):
+    return [
+        {
+            'text': f'Чанк номер {i}. ' * 20,
+            'chunk_info': {'position': i, 'total_chunks': n, 'size_chars': 300},
+        }
+        for i in range(n)
+    ]
+
+
+def bench_legacy(chunks, embeddings, queries, top_k):
+    import pandas as pd
+    from datasets import Dataset
+
+    start = time.perf_counter()
+    df = pd.DataFrame(chunks)
+    df["embeddings"] = list(embeddings)
+    dataset = Dataset.from_pandas(df)
+    dataset.add_faiss_index(column="embeddings")
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for query in queries:
+        scores, samples = dataset.get_nearest_examples("embeddings", query, k=top_k)
+        [(text, float(score), info["position"]) for score, text, info
+         in zip(scores, samples["text"], samples["chunk_info"])]
+    query_time = (time.perf_counter() - start) / len(queries)
+    return build_time, query_time
+
+
+def bench_native(chunks, embeddings, queries, top_k):
+    start = time.perf_counter()
+    index = DocumentIndex("", chunks=chunks, embeddings=embeddings)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query, top_k)
+    query_time = (time.perf_counter() - start) / len(queries)
+    return build_time, query_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'путь':<10}{'чанков':>10}{'построение, мс':>18}{'запрос, мс':>14}")
+    for n in args.chunks:
+        chunks = make_chunks(n)
+        embeddings = rng.standard_normal((n, args.dim), dtype=np.float32)
+        queries = rng.standard_normal((args.queries, args.dim), dtype=np.float32)
+
+        runs = [('numpy', bench_native)]
+        try:
+            import datasets  # noqa: F401
+            import pandas  # noqa: F401
+            runs.insert(0, ('datasets', bench_legacy))
+        except ImportError:
+            print("pandas/datasets не установлены, прежний путь пропущен")
+
+        for name, bench in runs:
+            build_time, query_time = bench(chunks, embeddings, queries, args.top_k)
+            print(f"{name:<10}{n:>10}{build_time * 1000:>18.1f}{query_time * 1000:>14.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import copy
+import re
+import threading
+import weakref
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Приближенный подсчет токенов, если токенизатор модели недоступен
+FALLBACK_TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+# Минимальная длина совпадения конца и начала соседних чанков, считающаяся перекрытием
+MIN_OVERLAP = 5
+
+# Копии токенизаторов моделей для подсчета токенов
+_counting_tokenizers: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_counting_lock = threading.Lock()
+
+
+def counting_tokenizer(tokenizer):
+    """Отдельная копия быстрого токенизатора для подсчета токенов.
+
+    Модель эмбеддингов вызывает свой токенизатор с усечением, а подсчет токенов идет
+    без усечения. Переключение настроек одного токенизатора из разных потоков
+    (векторизация вопросов и сборка контекста в параллельных запросах) приводит
+    к ошибке "Already borrowed", поэтому подсчет использует копию.
+    """
+    with _counting_lock:
+        counter = _counting_tokenizers.get(tokenizer)
+        if counter is None:
+            counter = _counting_tokenizers[tokenizer] = copy.deepcopy(tokenizer)
+        return counter
+
+
+class ContextBuilder:
+    """Сборка контекста для LLM из найденных чанков.
+
+    Чанки выбираются в порядке релевантности, пока укладываются в бюджет токенов,
+    повторы отбрасываются, а выбранные чанки упорядочиваются по позиции в документе.
+    Соседние чанки склеиваются с удалением перекрытия, которое оставляет разбиение
+    на чанки (chunk_overlap), поэтому один и тот же текст не попадает в промпт дважды.
+
+    Args:
+        tokenizer: быстрый токенизатор (например, токенизатор модели эмбеддингов);
+            если не задан, токены считаются приближенно по словам и знакам препинания
+        token_budget: максимальное число токенов контекста
+        chunk_overlap: перекрытие соседних чанков в символах
+    """
+
+    def __init__(self, tokenizer=None, token_budget: int = 2000, chunk_overlap: int = 30):
+        self.tokenizer = counting_tokenizer(tokenizer) if tokenizer is not None else None
+        self.token_budget = token_budget
+        self.chunk_overlap = chunk_overlap
+
+    def count_tokens(self, texts: Sequence[str]) -> List[int]:
+        """Число токенов в каждом тексте."""
+        if not texts:
+            return []
+        if self.tokenizer is not None:
+            encoded = self.tokenizer(list(texts), add_special_tokens=False)['input_ids']
+            return [len(ids) for ids in encoded]
+        return [len(FALLBACK_TOKEN_PATTERN.findall(text)) for text in texts]
+
+    def build(self, results: List[Dict[str, Any]]) -> Tuple[str, Dict[str, int]]:
+        """
+        Returns:
+            (контекст, статистика: сколько чанков использовано, отброшено, склеено
+            и сколько токенов сэкономлено по сравнению с простой конкатенацией)
+        """
+        unique, duplicates = self._deduplicate(results)
+        token_counts = self.count_tokens([res["text"] for res in unique])
+
+        # Выбор по релевантности в пределах бюджета; самый релевантный чанк берется всегда
+        selected, used_tokens = [], 0
+        for res, tokens in zip(unique, token_counts):
+            if selected and used_tokens + tokens > self.token_budget:
+                continue
+            selected.append(res)
+            used_tokens += tokens
+
+        # Порядок документа: по документу, затем по позиции чанка
+        selected.sort(key=lambda res: (res.get("text_id") or "", res["position"]))
+        parts, merged = self._merge_adjacent(selected)
+        context = "\n\n".join(parts)
+
+        naive_tokens, context_tokens = self.count_tokens(
+            ["\n\n".join(res["text"] for res in results), context])
+        stats = {
+            "chunks_in": len(results),
+            "chunks_used": len(selected),
+            "duplicates": duplicates,
+            "merged": merged,
+            "naive_tokens": naive_tokens,
+            "context_tokens": context_tokens,
+            "saved_tokens": naive_tokens - context_tokens,
+        }
+        return context, stats
+
+    @staticmethod
+    def _deduplicate(results: List[Dict[str, Any]]):
+        seen_ids, seen_texts = set(), set()
+        unique = []
+        for res in results:
+            chunk_id = (res.get("text_id"), res["position"])
+            text = res["text"].strip()
+            if chunk_id in seen_ids or text in seen_texts:
+                continue
+            seen_ids.add(chunk_id)
+            seen_texts.add(text)
+            unique.append(res)
+        return unique, len(results) - len(unique)
+
+    def _merge_adjacent(self, selected: List[Dict[str, Any]]) -> Tuple[List[str], int]:
+        parts: List[str] = []
+        merged = 0
+        previous: Optional[Dict[str, Any]] = None
+        for res in selected:
+            if (previous is not None and res.get("text_id") == previous.get("text_id")
+                    and res["position"] == previous["position"] + 1):
+                parts[-1] = self._join_overlapping(parts[-1], res["text"])
+                merged += 1
+            else:
+                parts.append(res["text"])
+            previous = res
+        return parts, merged
+
+    def _join_overlapping(self, left: str, right: str) -> str:
+        """Склейка соседних чанков: общий фрагмент на стыке включается один раз."""
+        max_overlap = min(len(left), len(right), 2 * self.chunk_overlap)
+        for size in range(max_overlap, MIN_OVERLAP - 1, -1):
+            if left.endswith(right[:size]):
+                return left + right[size:]
+        return left + " " + right
@@ -0,0 +1,310 @@
+import hashlib
+import logging
+import math
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import faiss
+import numpy as np
+
+from batching import query_encoder
+from embeddings import model_registry
+from lexical import BM25Index
+from searching import SCALAR_QUANTIZERS, VECTOR_DTYPES, make_flat_index, reciprocal_rank_fusion
+
+logger = logging.getLogger(__name__)
+
+# Идентификатор вектора: номер документа в старших 32 битах, позиция чанка — в младших
+POSITION_BITS = 32
+
+
+class CorpusIndex:
+    """Общий поисковый индекс по нескольким документам.
+
+    Документы добавляются и удаляются по одному, без перестроения индекса остальных.
+    Каждый вектор хранит номер документа и позицию чанка в своем идентификаторе,
+    поэтому поиск можно ограничить подмножеством документов.
+    Пока корпус небольшой, используется точный IndexFlatL2; при росте больше flat_threshold
+    векторов индекс перестраивается в IndexIVFFlat (приближенный поиск по nprobe кластерам).
+    HNSW не используется: он не поддерживает удаление векторов.
+
+    Args:
+        flat_threshold: число векторов, начиная с которого используется IVF
+        nprobe: число просматриваемых кластеров IVF при поиске
+        vector_dtype: тип хранения векторов ('float32', 'float16', 'int8'); точный индекс
+            хранит int8-корпус в float16, так как квантизатор int8 требует обучения
+            на всем корпусе, а он пополняется по одному документу
+    """
+
+    def __init__(self, flat_threshold: int = 50_000, nprobe: int = 16, vector_dtype: str = 'float32'):
+        if vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Тип векторов {vector_dtype} не поддерживается, используйте {VECTOR_DTYPES}")
+        self.flat_threshold = flat_threshold
+        self.nprobe = nprobe
+        self.vector_dtype = vector_dtype
+        self.dim = None
+        self.faiss_index = None
+        self.model_name = None
+        self.device = None
+        self._documents: Dict[str, Dict[str, Any]] = {}
+        self._doc_numbers: Dict[int, str] = {}
+        self._next_doc_number = 0
+        self._trained_size = 0
+        self._lock = threading.RLock()
+
+    def __contains__(self, text_id: str) -> bool:
+        return text_id in self._documents
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    @property
+    def ntotal(self) -> int:
+        return self.faiss_index.ntotal if self.faiss_index is not None else 0
+
+    @property
+    def index_type(self) -> str:
+        if self.faiss_index is None:
+            return 'empty'
+        return 'ivf' if isinstance(self.faiss_index, faiss.IndexIVF) else 'flat'
+
+    def add_index(self, text_id: str, document_index) -> None:
+        """Добавление документа из готового DocumentIndex."""
+        self.add_document(text_id, document_index.embeddings, document_index.texts,
+                          document_index.positions, document_index.sizes,
+                          model_name=document_index.model_name, device=document_index.device,
+                          text_hash=document_index.text_hash, lexical_index=document_index.lexical_index)
+
+    def add_document(self, text_id: str, embeddings: np.ndarray, texts: Sequence[str],
+                     positions: Sequence[int], sizes: Sequence[int],
+                     model_name: Optional[str] = None, device: Optional[str] = None,
+                     text_hash: Optional[str] = None, lexical_index: Optional[BM25Index] = None) -> None:
+        """Добавление документа; повторное добавление заменяет прежнюю версию.
+
+        text_hash — хэш содержимого документа: входит в хэш набора документов
+        CorpusView, чтобы после обновления документа не использовались старые ответы.
+        lexical_index — BM25-индекс чанков документа (по умолчанию строится по texts).
+        """
+        vectors = np.ascontiguousarray(embeddings, dtype='float32')
+        with self._lock:
+            if self.dim is not None and vectors.shape[1] != self.dim:
+                raise ValueError(f"Размерность эмбеддингов {vectors.shape[1]} не совпадает с индексом ({self.dim})")
+            if self.model_name is not None and model_name is not None and model_name != self.model_name:
+                raise ValueError(f"Документ векторизован моделью {model_name}, а корпус — {self.model_name}")
+            if text_id in self._documents:
+                self.remove_document(text_id)
+
+            self.dim = vectors.shape[1]
+            self.model_name = self.model_name or model_name
+            self.device = self.device or device
+            doc_number = self._next_doc_number
+            self._next_doc_number += 1
+
+            positions = np.asarray(positions, dtype='int64')
+            ids = self._vector_ids(doc_number, positions)
+            self._documents[text_id] = {
+                'number': doc_number,
+                'text_hash': text_hash or hashlib.sha256('\n'.join(texts).encode('utf-8')).hexdigest(),
+                'embeddings': embeddings,
+                'texts': list(texts),
+                'positions': positions,
+                'ids': ids,
+                'sizes': np.asarray(sizes, dtype='int32'),
+                'lexical_index': lexical_index if lexical_index is not None else BM25Index(texts),
+                # Строка метаданных по позиции чанка
+                'rows': {int(position): row for row, position in enumerate(positions)},
+            }
+            self._doc_numbers[doc_number] = text_id
+
+            if self._needs_rebuild(self.ntotal + len(vectors)):
+                self._rebuild()
+            else:
+                self._ensure_index()
+                self.faiss_index.add_with_ids(vectors, ids)
+            logger.info(f"Документ {text_id} добавлен в корпус: {len(vectors)} векторов, "
+                        f"всего {self.ntotal} ({self.index_type})")
+
+    def remove_document(self, text_id: str) -> bool:
+        """Удаление документа из корпуса; возвращает False, если его не было."""
+        with self._lock:
+            document = self._documents.pop(text_id, None)
+            if document is None:
+                return False
+            doc_number = document['number']
+            del self._doc_numbers[doc_number]
+            self.faiss_index.remove_ids(faiss.IDSelectorRange(
+                doc_number << POSITION_BITS, (doc_number + 1) << POSITION_BITS))
+            return True
+
+    def content_hash(self, text_ids: Optional[Iterable[str]] = None) -> str:
+        """Хэш текущих версий документов text_ids (по умолчанию — всех)."""
+        with self._lock:
+            ids = sorted(text_ids) if text_ids is not None else sorted(self._documents)
+            parts = [f"{text_id}:{self._documents[text_id]['text_hash'] if text_id in self._documents else ''}"
+                     for text_id in ids]
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def view(self, text_ids: Optional[Iterable[str]] = None) -> "CorpusView":
+        """Поисковое представление корпуса, ограниченное указанными документами."""
+        return CorpusView(self, list(text_ids) if text_ids is not None else None)
+
+    def search(self, question_embedding, top_k: int = 5,
+               text_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Возвращает top_k наиболее релевантных чанков среди документов text_ids (по умолчанию — всех)."""
+        query_vector = np.array(question_embedding, dtype='float32').reshape(1, -1)
+        with self._lock:
+            if self.ntotal == 0:
+                raise ValueError("FAISS-индекс не инициализирован")
+
+            if text_ids is not None:
+                numbers = {self._documents[text_id]['number'] for text_id in text_ids
+                           if text_id in self._documents}
+                if not numbers:
+                    return []
+                selector = self._selector(numbers)
+            else:
+                selector = None
+
+            if isinstance(self.faiss_index, faiss.IndexIVF):
+                params = faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+            else:
+                params = faiss.SearchParameters(sel=selector)
+            scores, ids = self.faiss_index.search(query_vector, min(top_k, self.ntotal), params=params)
+
+            results = []
+            for score, vector_id in zip(scores[0], ids[0]):
+                if vector_id < 0:
+                    continue
+                text_id = self._doc_numbers[int(vector_id) >> POSITION_BITS]
+                document = self._documents[text_id]
+                row = document['rows'][int(vector_id) & ((1 << POSITION_BITS) - 1)]
+                results.append(
+                    {
+                        "text": document['texts'][row],
+                        "score": float(score),
+                        "position": int(document['positions'][row]),
+                        "chunk_size": int(document['sizes'][row]),
+                        "text_id": text_id,
+                    }
+                )
+            return results
+
+    def lexical_search(self, query: str, top_k: int = 5,
+                       text_ids: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+        """Возвращает top_k чанков по BM25 среди документов text_ids (по умолчанию — всех).
+
+        Оценки BM25 разных документов несравнимы (у каждого документа своя статистика терминов),
+        поэтому списки документов объединяются по рангам методом reciprocal rank fusion.
+        """
+        with self._lock:
+            ids = list(text_ids) if text_ids is not None else list(self._documents)
+            documents = [(text_id, self._documents[text_id]) for text_id in ids if text_id in self._documents]
+
+        result_lists = []
+        for text_id, document in documents:
+            result_lists.append([
+                {
+                    "text": document['texts'][row],
+                    "score": score,
+                    "position": int(document['positions'][row]),
+                    "chunk_size": int(document['sizes'][row]),
+                    "text_id": text_id,
+                }
+                for row, score in document['lexical_index'].search(query, top_k)
+            ])
+        if len(result_lists) == 1:
+            return result_lists[0]
+        return reciprocal_rank_fusion(result_lists, names=['lexical'] * len(result_lists))[:top_k]
+
+    def _ensure_index(self) -> None:
+        if self.faiss_index is None:
+            self.faiss_index = faiss.IndexIDMap2(self._flat_index())
+
+    def _needs_rebuild(self, total: int) -> bool:
+        if total < self.flat_threshold:
+            return False
+        # IVF переобучается, когда корпус вырос в 4 раза с момента обучения
+        return self.index_type != 'ivf' or total > 4 * self._trained_size
+
+    def _rebuild(self) -> None:
+        """Перестроение индекса с выбором типа по размеру корпуса."""
+        documents = list(self._documents.values())
+        total = sum(len(document['positions']) for document in documents)
+
+        if total < self.flat_threshold:
+            self.faiss_index = faiss.IndexIDMap2(self._flat_index())
+            self._trained_size = 0
+        else:
+            nlist = max(1, min(int(4 * math.sqrt(total)), total // 39))
+            quantizer = faiss.IndexFlatL2(self.dim)
+            if self.vector_dtype == 'float32':
+                index = faiss.IndexIVFFlat(quantizer, self.dim, nlist)
+            else:
+                index = faiss.IndexIVFScalarQuantizer(quantizer, self.dim, nlist,
+                                                      SCALAR_QUANTIZERS[self.vector_dtype], faiss.METRIC_L2)
+            index.train(self._training_sample(documents, total, 64 * nlist))
+            self.faiss_index = index
+            self._trained_size = total
+            logger.info(f"Корпус перестроен в IVF: {total} векторов, {nlist} кластеров")
+
+        for document in documents:
+            self.faiss_index.add_with_ids(
+                np.ascontiguousarray(document['embeddings'], dtype='float32'), document['ids'])
+
+    def _flat_index(self) -> faiss.Index:
+        return make_flat_index(self.dim, 'float32' if self.vector_dtype == 'float32' else 'float16')
+
+    @staticmethod
+    def _training_sample(documents, total: int, sample_size: int) -> np.ndarray:
+        vectors = np.concatenate([np.asarray(document['embeddings'], dtype='float32')
+                                  for document in documents])
+        if total <= sample_size:
+            return vectors
+        rng = np.random.default_rng(0)
+        return np.ascontiguousarray(vectors[rng.choice(total, sample_size, replace=False)])
+
+    @staticmethod
+    def _vector_ids(doc_number: int, positions: np.ndarray) -> np.ndarray:
+        return (np.int64(doc_number) << POSITION_BITS) | positions.astype('int64')
+
+    def _selector(self, doc_numbers: Iterable[int]) -> faiss.IDSelector:
+        """Селектор векторов выбранных документов: диапазон идентификаторов, если номера
+        документов идут подряд, иначе множество идентификаторов их векторов."""
+        numbers = sorted(doc_numbers)
+        if numbers[-1] - numbers[0] + 1 == len(numbers):
+            return faiss.IDSelectorRange(numbers[0] << POSITION_BITS, (numbers[-1] + 1) << POSITION_BITS)
+        return faiss.IDSelectorBatch(np.concatenate(
+            [self._documents[self._doc_numbers[number]]['ids'] for number in numbers]))
+
+
+class CorpusView:
+    """Поиск по корпусу, ограниченный набором документов.
+
+    Имеет тот же интерфейс, что и DocumentIndex, и может передаваться в SemanticSearch.
+    """
+
+    def __init__(self, corpus: CorpusIndex, text_ids: Optional[List[str]] = None):
+        self.corpus = corpus
+        self.text_ids = text_ids
+
+    @property
+    def model(self):
+        return model_registry.get(self.corpus.model_name, self.corpus.device)
+
+    @property
+    def chunks(self) -> List[Dict]:
+        return []
+
+    @property
+    def text_hash(self) -> str:
+        """Хэш набора документов и их содержимого для ключей кэша ответов."""
+        return self.corpus.content_hash(self.text_ids)
+
+    def embed_query(self, query: str):
+        return query_encoder.encode(query, self.corpus.model_name, self.corpus.device)
+
+    def search(self, question_embedding, top_k: int = 5) -> List[Dict[str, Any]]:
+        return self.corpus.search(question_embedding, top_k, self.text_ids)
+
+    def lexical_search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        return self.corpus.lexical_search(query, top_k, self.text_ids)
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+
+import metrics
+from embeddings import model_registry
+from searching import DocumentIndex
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+class DiskIndexCache:
+    """Кэш индексов документов на диске.
+
+    Ключ — хэш очищенного текста, имени и бэкенда модели, типа векторов и параметров разбиения на чанки,
+    поэтому одинаковые документы после перезапуска загружаются без повторной векторизации.
+    Для каждого ключа хранится каталог:
+        meta.json        — параметры индекса
+        chunks.json      — список чанков
+        embeddings.npy   — матрица эмбеддингов (float32 или float16), открывается через mmap
+        index.faiss      — сериализованный FAISS-индекс
+    Отдельно хранится извлеченный текст файлов по хэшу их содержимого,
+    чтобы повторная загрузка того же файла не запускала OCR.
+
+    Args:
+        root: каталог кэша
+        dtype: тип хранения эмбеддингов на диске ('float32' или 'float16')
+    """
+
+    def __init__(self, root: str = '.cache', dtype: str = 'float32'):
+        if dtype not in ('float32', 'float16'):
+            raise ValueError(f"Тип {dtype} не поддерживается, используйте float32 или float16")
+        self.root = root
+        self.dtype = dtype
+        os.makedirs(os.path.join(root, 'indexes'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'texts'), exist_ok=True)
+
+    @staticmethod
+    def content_hash(data) -> str:
+        """SHA-256 от строки или байтов."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def file_hash(path: str, block_size: int = 1024 * 1024) -> str:
+        """SHA-256 содержимого файла, читаемого блоками."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    @classmethod
+    def index_key(cls, text: str, model: str, chunk_size: int, chunk_overlap: int,
+                  backend: str = 'torch', vector_dtype: str = 'float32') -> str:
+        """Ключ индекса: хэш текста + модель + параметры чанков."""
+        params = f"v{FORMAT_VERSION}|{model}|{chunk_size}|{chunk_overlap}|"
+        # Для исходного бэкенда ключ не меняется, чтобы сохранить ранее записанный кэш
+        if (backend, vector_dtype) != ('torch', 'float32'):
+            params += f"{backend}|{vector_dtype}|"
+        return cls.content_hash(params + cls.content_hash(text))
+
+    def load_index(self, text: str, model: str, device: Optional[str] = None,
+                   chunk_size: int = 500, chunk_overlap: int = 30,
+                   backend: Optional[str] = None, vector_dtype: str = 'float32') -> Optional[DocumentIndex]:
+        """Загружает индекс документа с диска или возвращает None, если его нет."""
+        backend = backend or model_registry.backend
+        key = self.index_key(text, model, chunk_size, chunk_overlap, backend, vector_dtype)
+        path = self._index_path(key)
+        if not os.path.isdir(path):
+            metrics.record_cache('disk_index', False)
+            return None
+
+        try:
+            with open(os.path.join(path, 'chunks.json'), encoding='utf-8') as file:
+                chunks = json.load(file)
+            # Файл отображается в память: несколько процессов используют одну копию страниц
+            embeddings = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+            index = DocumentIndex(
+                text, model=model, device=device,
+                chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                chunks=chunks, embeddings=embeddings,
+                faiss_index_path=os.path.join(path, 'index.faiss'),
+                backend=backend, vector_dtype=vector_dtype,
+            )
+            logger.info(f"Индекс документа загружен из кэша {key[:12]}: {len(chunks)} чанков")
+            metrics.record_cache('disk_index', True)
+            return index
+        except Exception as e:
+            logger.error(f"Ошибка при чтении кэша индекса {key[:12]}: {str(e)}")
+            metrics.record_cache('disk_index', False)
+            return None
+
+    def save_index(self, index: DocumentIndex) -> None:
+        """Сохраняет индекс документа на диск."""
+        key = self.index_key(index.text, index.model_name, index.chunk_size, index.chunk_overlap,
+                             index.backend, index.vector_dtype)
+        path = self._index_path(key)
+        if os.path.isdir(path):
+            return
+
+        # Запись во временный каталог и атомарное переименование,
+        # чтобы другие процессы не прочитали частично записанный индекс
+        tmp_path = tempfile.mkdtemp(dir=os.path.join(self.root, 'indexes'), prefix='.tmp-')
+        # Сжатые индексы уже хранят эмбеддинги в float16
+        dtype = self.dtype if index.vector_dtype == 'float32' else 'float16'
+        try:
+            with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as file:
+                json.dump({
+                    'version': FORMAT_VERSION,
+                    'model': index.model_name,
+                    'chunk_size': index.chunk_size,
+                    'chunk_overlap': index.chunk_overlap,
+                    'dtype': dtype,
+                    'backend': index.backend,
+                    'vector_dtype': index.vector_dtype,
+                    'count': len(index.chunks),
+                }, file)
+            with open(os.path.join(tmp_path, 'chunks.json'), 'w', encoding='utf-8') as file:
+                json.dump(index.chunks, file, ensure_ascii=False)
+            np.save(os.path.join(tmp_path, 'embeddings.npy'),
+                    np.ascontiguousarray(index.embeddings, dtype=dtype))
+            index.save_faiss_index(os.path.join(tmp_path, 'index.faiss'))
+            os.replace(tmp_path, path)
+            logger.info(f"Индекс документа сохранен в кэш {key[:12]}")
+        except OSError as e:
+            # Каталог мог быть создан параллельно другим процессом
+            logger.warning(f"Не удалось сохранить индекс {key[:12]} в кэш: {str(e)}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def load_text_meta(self, file_hash: str) -> Dict:
+        """Сведения о файле (например, число страниц), сохраненные вместе с текстом."""
+        path = self._text_path(file_hash)[:-len('.txt')] + '.json'
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+
+    def load_text(self, file_hash: str) -> Optional[str]:
+        """Возвращает ранее извлеченный текст файла по хэшу его содержимого."""
+        path = self._text_path(file_hash)
+        metrics.record_cache('disk_text', os.path.exists(path))
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding='utf-8') as file:
+            return file.read()
+
+    def save_text(self, file_hash: str, text: str, meta: Optional[Dict] = None) -> None:
+        """Сохраняет извлеченный из файла текст и сведения о файле."""
+        path = self._text_path(file_hash)
+        if meta:
+            self._write_atomic(path[:-len('.txt')] + '.json', json.dumps(meta))
+        self._write_atomic(path, text)
+
+    @staticmethod
+    def _write_atomic(path: str, content: str) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(content)
+        os.replace(tmp_path, path)
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self.root, 'indexes', key)
+
+    def _text_path(self, file_hash: str) -> str:
+        return os.path.join(self.root, 'texts', f'{file_hash}.txt')
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+
+from index_cache import BoundedCache
+from jobs import FAILED, READY
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r'\S+')
+PREVIEW_WORDS = 150
+
+
+def make_preview(text: str, words: int = PREVIEW_WORDS) -> str:
+    """Первые words слов текста; текст целиком не разбивается."""
+    matches = WORD_PATTERN.finditer(text)
+    preview = [match.group() for _, match in zip(range(words), matches)]
+    more = next(matches, None) is not None
+    return ' '.join(preview) + ('...' if more else '')
+
+
+def build_metadata(text: str, pages: Optional[int] = None, filename: Optional[str] = None) -> Dict[str, Any]:
+    """Метаданные документа, вычисляемые один раз при загрузке."""
+    return {
+        'length': len(text),
+        'words': sum(1 for _ in WORD_PATTERN.finditer(text)),
+        'pages': pages,
+        'hash': hashlib.sha256(text.encode('utf-8')).hexdigest(),
+        'preview': make_preview(text),
+        'filename': filename,
+        'created_at': time.time(),
+    }
+
+
+class DocumentStore(ABC):
+    """Хранилище текстов загруженных документов и их метаданных.
+
+    on_evict(text_id) вызывается, когда документ удаляется из хранилища
+    (в том числе при вытеснении), чтобы освободить связанные с ним индексы.
+    """
+
+    def __init__(self):
+        self.on_evict: Optional[Callable[[str], None]] = None
+
+    def put(self, text_id: str, text: str, meta: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Сохраняет документ; метаданные дополняются вычисленными по тексту. Возвращает метаданные."""
+        meta = {**build_metadata(text), **(meta or {})}
+        self._put(text_id, text, meta)
+        return meta
+
+    @abstractmethod
+    def get_text(self, text_id: str) -> Optional[str]:
+        """Текст документа или None, если его нет."""
+
+    @abstractmethod
+    def get_meta(self, text_id: str) -> Optional[Dict[str, Any]]:
+        """Метаданные документа или None, если его нет."""
+
+    @abstractmethod
+    def delete(self, text_id: str) -> bool:
+        """Удаляет документ; возвращает True, если он был в хранилище."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Число документов и занятый ими объем."""
+
+    def put_job(self, status: Dict[str, Any]) -> None:
+        """Сохраняет статус задачи обработки (IngestionJob.to_dict()), чтобы его видели
+        другие процессы приложения. В памяти процесса статусы хранит JobManager."""
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Статус задачи, сохраненный put_job, или None."""
+        return None
+
+    def __contains__(self, text_id: str) -> bool:
+        return self.get_meta(text_id) is not None
+
+    @abstractmethod
+    def _put(self, text_id: str, text: str, meta: Dict[str, Any]) -> None:
+        """Сохранение документа с уже вычисленными метаданными."""
+
+    def _evicted(self, text_id: str) -> None:
+        if self.on_evict:
+            try:
+                self.on_evict(text_id)
+            except Exception as e:
+                logger.error(f"Ошибка при освобождении ресурсов документа {text_id}: {str(e)}")
+
+
+class MemoryDocumentStore(DocumentStore):
+    """Хранилище в памяти процесса с вытеснением давно не использовавшихся документов.
+
+    Args:
+        max_bytes: бюджет памяти на тексты документов
+        max_items: максимальное число документов (None — без ограничения)
+    """
+
+    def __init__(self, max_bytes: Optional[int] = 512 * 1024 ** 2, max_items: Optional[int] = None):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        # Элемент — (текст, метаданные); вытесненные документы передаются в on_evict
+        self._items = BoundedCache(max_items=max_items, max_bytes=max_bytes, name='documents')
+        self._items.on_evict = self._evicted
+
+    def get_text(self, text_id: str) -> Optional[str]:
+        entry = self._items.get(text_id)
+        return entry[0] if entry else None
+
+    def get_meta(self, text_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._items.get(text_id)
+        return dict(entry[1]) if entry else None
+
+    def delete(self, text_id: str) -> bool:
+        entry = self._items.pop(text_id)
+        if entry is not None:
+            self._evicted(text_id)
+        return entry is not None
+
+    def stats(self) -> Dict[str, Any]:
+        return {'backend': 'memory', 'documents': len(self._items), 'bytes': self._items.nbytes,
+                'max_bytes': self.max_bytes}
+
+    def _put(self, text_id: str, text: str, meta: Dict[str, Any]) -> None:
+        self._items.put(text_id, (text, meta), size=sys.getsizeof(text))
+
+
+class SQLiteDocumentStore(DocumentStore):
+    """Хранилище в файле SQLite: документы доступны всем процессам приложения
+    (например, нескольким воркерам gunicorn) и сохраняются после перезапуска.
+    Метаданные и превью хранятся отдельно от текста и читаются без него.
+    Здесь же хранятся статусы задач обработки, чтобы /status отвечал любой воркер.
+    При превышении бюджета вытесняются документы, к которым дольше всего не обращались.
+
+    Args:
+        path: путь к файлу базы
+        max_bytes: бюджет на тексты документов (None — без ограничения)
+    """
+
+    # Время последнего обращения обновляется не чаще раза в ACCESS_RESOLUTION секунд,
+    # чтобы частые чтения одного документа не превращались в запись
+    ACCESS_RESOLUTION = 1.0
+    # Сколько секунд хранятся статусы завершенных задач обработки
+    JOB_TTL = 24 * 3600
+
+    def __init__(self, path: str, max_bytes: Optional[int] = 512 * 1024 ** 2):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    text_id TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    meta TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL DEFAULT 0
+                )""")
+            # Базы, созданные до появления вытеснения, дополняются недостающей колонкой
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(documents)")}
+            if 'last_access' not in columns:
+                connection.execute("ALTER TABLE documents ADD COLUMN last_access REAL NOT NULL DEFAULT 0")
+                connection.execute("UPDATE documents SET last_access = created_at")
+            connection.execute("CREATE INDEX IF NOT EXISTS documents_last_access ON documents (last_access)")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+
+    def get_text(self, text_id: str) -> Optional[str]:
+        row = self._connection().execute(
+            "SELECT text, last_access FROM documents WHERE text_id = ?", (text_id,)).fetchone()
+        if row:
+            self._touch(text_id, row[1])
+        return row[0] if row else None
+
+    def get_meta(self, text_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT meta, last_access FROM documents WHERE text_id = ?", (text_id,)).fetchone()
+        if row:
+            self._touch(text_id, row[1])
+        return json.loads(row[0]) if row else None
+
+    def delete(self, text_id: str) -> bool:
+        with self._connection() as connection:
+            deleted = connection.execute("DELETE FROM documents WHERE text_id = ?", (text_id,)).rowcount > 0
+        if deleted:
+            self._evicted(text_id)
+        return deleted
+
+    def put_job(self, status: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO jobs (job_id, status, updated_at) VALUES (?, ?, ?)",
+                               (status['text_id'], json.dumps(status, ensure_ascii=False), now))
+            if status['status'] in (READY, FAILED):
+                connection.execute("DELETE FROM jobs WHERE updated_at < ?", (now - self.JOB_TTL,))
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def stats(self) -> Dict[str, Any]:
+        count, size = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM documents").fetchone()
+        return {'backend': 'sqlite', 'documents': count, 'bytes': size, 'max_bytes': self.max_bytes,
+                'path': self.path}
+
+    def _put(self, text_id: str, text: str, meta: Dict[str, Any]) -> None:
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO documents (text_id, text, meta, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (text_id, text, json.dumps(meta, ensure_ascii=False), len(text.encode('utf-8')),
+                 meta['created_at'], time.time()))
+            evicted = self._evict(connection, text_id)
+        for evicted_id in evicted:
+            self._evicted(evicted_id)
+
+    def _evict(self, connection: sqlite3.Connection, keep_id: str) -> List[str]:
+        """Удаляет давно не использовавшиеся документы сверх бюджета в транзакции записи;
+        только что сохраненный документ не вытесняется, даже если он один превышает бюджет."""
+        if self.max_bytes is None:
+            return []
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM documents").fetchone()[0]
+        evicted = []
+        if total <= self.max_bytes:
+            return evicted
+        rows = connection.execute(
+            "SELECT text_id, size FROM documents WHERE text_id != ? ORDER BY last_access", (keep_id,))
+        for evicted_id, size in rows.fetchall():
+            if total <= self.max_bytes:
+                break
+            connection.execute("DELETE FROM documents WHERE text_id = ?", (evicted_id,))
+            total -= size
+            evicted.append(evicted_id)
+            logger.info(f"{evicted_id} вытеснен из хранилища документов")
+        return evicted
+
+    def _touch(self, text_id: str, last_access: float) -> None:
+        now = time.time()
+        if now - last_access < self.ACCESS_RESOLUTION:
+            return
+        with self._connection() as connection:
+            connection.execute("UPDATE documents SET last_access = ? WHERE text_id = ?", (now, text_id))
+
+    def _connection(self) -> sqlite3.Connection:
+        """Отдельное соединение для каждого потока."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            # WAL: чтение из других процессов не блокируется записью
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+
+def make_document_store(backend: str = 'memory', max_bytes: Optional[int] = 512 * 1024 ** 2,
+                        path: Optional[str] = None) -> DocumentStore:
+    """Хранилище по имени бэкенда: 'memory' или 'sqlite'."""
+    if backend == 'memory':
+        return MemoryDocumentStore(max_bytes=max_bytes)
+    if backend == 'sqlite':
+        if not path:
+            raise ValueError("Для хранилища sqlite укажите путь к файлу базы")
+        return SQLiteDocumentStore(path, max_bytes=max_bytes)
+    raise ValueError(f"Хранилище {backend} не поддерживается, используйте memory или sqlite")
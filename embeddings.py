@@ -0,0 +1,170 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+from sentence_transformers import CrossEncoder, SentenceTransformer
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'ai-forever/ru-en-RoSBERTa'
+DEFAULT_RERANKER = 'DiTy/cross-encoder-russian-msmarco'
+
+# torch — исходная модель PyTorch, onnx — экспорт в ONNX Runtime,
+# onnx-int8 — ONNX с динамической квантизацией весов в int8
+EMBEDDING_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+
+class ModelRegistry:
+    """Общий для процесса реестр моделей эмбеддингов и переранжирования.
+
+    Модели загружаются лениво при первом обращении и переиспользуются
+    между запросами. Ключ реестра — (имя модели, устройство, вид модели):
+    модели эмбеддингов и модели переранжирования хранятся вместе.
+    Количество одновременно загруженных моделей ограничено max_models:
+    при превышении выгружается давно не использовавшаяся модель.
+
+    Args:
+        backend: бэкенд моделей эмбеддингов по умолчанию, один из EMBEDDING_BACKENDS
+        batch_size: размер батча при векторизации чанков
+        threads: число потоков вычислений на CPU (по умолчанию — решает библиотека)
+        max_seq_length: максимальная длина входа в токенах (по умолчанию — из модели)
+        onnx_dir: каталог для квантизованных ONNX-моделей
+        quantization: набор инструкций для квантизации int8 ('avx2', 'avx512', 'avx512_vnni', 'arm64')
+    """
+
+    def __init__(self, max_models: int = 2, device: Optional[str] = None,
+                 backend: str = 'torch', batch_size: int = 32, threads: Optional[int] = None,
+                 max_seq_length: Optional[int] = None, onnx_dir: str = os.path.join('.cache', 'onnx'),
+                 quantization: str = 'avx2'):
+        if max_models < 1:
+            raise ValueError("max_models должен быть не меньше 1")
+        self.max_models = max_models
+        self.device = device
+        self.backend = backend
+        self.batch_size = batch_size
+        self.threads = threads
+        self.max_seq_length = max_seq_length
+        self.onnx_dir = onnx_dir
+        self.quantization = quantization
+        self._models: "OrderedDict[Tuple[str, Optional[str], str], Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, model_name: str = DEFAULT_MODEL, device: Optional[str] = None,
+            backend: Optional[str] = None) -> SentenceTransformer:
+        """Возвращает загруженную модель эмбеддингов, при необходимости загружая ее."""
+        device = device or self.device
+        backend = backend or self.backend
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Бэкенд {backend} не поддерживается, используйте {EMBEDDING_BACKENDS}")
+        kind = 'embedding' if backend == 'torch' else f'embedding-{backend}'
+        return self._get((model_name, device, kind),
+                         lambda: self._load_embedding_model(model_name, device, backend))
+
+    def get_reranker(self, model_name: str = DEFAULT_RERANKER, device: Optional[str] = None) -> CrossEncoder:
+        """Возвращает загруженную модель переранжирования (cross-encoder)."""
+        device = device or self.device
+        return self._get((model_name, device, 'reranker'),
+                         lambda: CrossEncoder(model_name, device=device))
+
+    def _load_embedding_model(self, model_name: str, device: Optional[str], backend: str) -> SentenceTransformer:
+        if backend == 'torch':
+            if self.threads:
+                import torch
+                torch.set_num_threads(self.threads)
+            model = SentenceTransformer(model_name, device=device)
+        else:
+            model_kwargs = {'provider': 'CPUExecutionProvider'}
+            if self.threads:
+                import onnxruntime
+                session_options = onnxruntime.SessionOptions()
+                session_options.intra_op_num_threads = self.threads
+                model_kwargs['session_options'] = session_options
+            model_name, model_kwargs['file_name'] = self._export_onnx(
+                model_name, device, model_kwargs['provider'], quantize=backend == 'onnx-int8')
+            model = SentenceTransformer(model_name, device=device, backend='onnx', model_kwargs=model_kwargs)
+
+        if self.max_seq_length:
+            model.max_seq_length = self.max_seq_length
+        return model
+
+    def _export_onnx(self, model_name: str, device: Optional[str], provider: str,
+                     quantize: bool = False) -> Tuple[str, str]:
+        """Локальная копия модели в формате ONNX (при quantize — с int8-квантизацией весов).
+        При первом обращении модель экспортируется и сохраняется в onnx_dir,
+        чтобы не повторять экспорт при каждом запуске. Возвращает (каталог модели, файл ONNX)."""
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        path = os.path.join(self.onnx_dir, re.sub(r'[^\w.-]', '_', model_name))
+        file_name = os.path.join('onnx', 'model.onnx')
+        model = None
+        if not os.path.exists(os.path.join(path, file_name)):
+            logger.info(f"Экспорт модели {model_name} в ONNX")
+            model = SentenceTransformer(model_name, device=device, backend='onnx',
+                                        model_kwargs={'provider': provider})
+            model.save(path)
+        if not quantize:
+            return path, file_name
+
+        file_suffix = f'int8_{self.quantization}'
+        file_name = os.path.join('onnx', f'model_{file_suffix}.onnx')
+        if not os.path.exists(os.path.join(path, file_name)):
+            logger.info(f"Квантизация модели {model_name} в int8 ({self.quantization})")
+            model = model or SentenceTransformer(path, device=device, backend='onnx',
+                                                 model_kwargs={'provider': provider})
+            export_dynamic_quantized_onnx_model(model, self.quantization, path, file_suffix=file_suffix)
+        return path, file_name
+
+    def _get(self, key: Tuple[str, Optional[str], str], load: Callable[[], Any]):
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Загрузка идет вне общей блокировки, чтобы не задерживать
+        # запросы к уже загруженным моделям
+        with key_lock:
+            with self._lock:
+                model = self._models.get(key)
+                if model is not None:
+                    self._models.move_to_end(key)
+                    return model
+
+            logger.info(f"Загрузка модели {key[0]} ({key[2]}, device={key[1]})")
+            with metrics.timed('model_load'):
+                model = load()
+
+            with self._lock:
+                self._models[key] = model
+                self._models.move_to_end(key)
+                while len(self._models) > self.max_models:
+                    evicted_key, _ = self._models.popitem(last=False)
+                    self._key_locks.pop(evicted_key, None)
+                    logger.info(f"Модель {evicted_key[0]} выгружена из реестра")
+            return model
+
+    def warm_up(self, model_name: str = DEFAULT_MODEL, device: Optional[str] = None,
+                backend: Optional[str] = None) -> None:
+        """Загрузка модели заранее, например при старте приложения."""
+        model = self.get(model_name, device, backend)
+        model.encode("warm up", prompt_name="search_query")
+
+    def loaded(self):
+        """Список ключей загруженных моделей."""
+        with self._lock:
+            return list(self._models.keys())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._key_locks.clear()
+
+
+model_registry = ModelRegistry()
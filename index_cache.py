@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedCache:
+    """Кэш в памяти с вытеснением давно не использовавшихся элементов (LRU) и по TTL.
+
+    Args:
+        max_items: максимальное число элементов (None — без ограничения)
+        max_bytes: бюджет памяти (None — без ограничения); размер элемента передается в put
+            или берется из его атрибута nbytes
+        ttl: время жизни элемента в секундах с момента последнего обращения (None — без ограничения)
+        name: имя кэша в журнале и метриках
+
+    on_evict(key) вызывается, когда элемент вытесняется из кэша или удаляется по истечении TTL,
+    чтобы освободить связанные с ним ресурсы; при явном pop не вызывается.
+    """
+
+    def __init__(self, max_items: Optional[int] = None, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None, name: str = 'cache'):
+        self.name = name
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.on_evict: Optional[Callable[[Hashable], None]] = None
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return self._bytes
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Возвращает элемент по ключу или None, если его нет или срок его жизни истек."""
+        with self._lock:
+            evicted = self._expire()
+            entry = self._items.get(key)
+            if entry is not None:
+                entry[1] = time.monotonic()
+                self._items.move_to_end(key)
+        self._evicted(evicted)
+        return entry[0] if entry is not None else None
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None) -> None:
+        """Сохраняет элемент и вытесняет старые при превышении лимитов."""
+        size = self._size_of(value) if size is None else size
+        with self._lock:
+            self._remove(key)
+            self._items[key] = [value, time.monotonic(), size]
+            self._bytes += size
+            evicted = self._evict()
+        self._evicted(evicted)
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._remove(key)
+            return entry[0] if entry else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    @staticmethod
+    def _size_of(value: Any) -> int:
+        return int(getattr(value, 'nbytes', 0))
+
+    def _remove(self, key: Hashable):
+        entry = self._items.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+        return entry
+
+    def _expire(self) -> List[Hashable]:
+        if self.ttl is None:
+            return []
+        deadline = time.monotonic() - self.ttl
+        expired = [key for key, entry in self._items.items() if entry[1] < deadline]
+        for key in expired:
+            self._remove(key)
+            logger.info(f"{key} удален из кэша {self.name} по истечении TTL")
+        return expired
+
+    def _evict(self) -> List[Hashable]:
+        evicted = self._expire()
+        # Последний добавленный элемент не вытесняется, даже если он один превышает бюджет
+        while len(self._items) > 1 and (
+                (self.max_items is not None and len(self._items) > self.max_items)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            key, entry = self._items.popitem(last=False)
+            self._bytes -= entry[2]
+            evicted.append(key)
+            logger.info(f"{key} вытеснен из кэша {self.name}")
+        return evicted
+
+    def _evicted(self, keys: List[Hashable]) -> None:
+        """Вызов on_evict вне блокировки кэша."""
+        if not self.on_evict:
+            return
+        for key in keys:
+            try:
+                self.on_evict(key)
+            except Exception as e:
+                logger.error(f"Ошибка при освобождении ресурсов {key} из кэша {self.name}: {str(e)}")
+
+
+class IndexCache(BoundedCache):
+    """Кэш поисковых индексов документов в памяти с вытеснением LRU/TTL.
+
+    Args:
+        max_items: максимальное число индексов в кэше
+        max_bytes: бюджет памяти; размер элемента берется из его атрибута nbytes
+        ttl: время жизни элемента в секундах с момента последнего обращения (None — без ограничения)
+        name: имя кэша в метриках попаданий
+    """
+
+    def __init__(self, max_items: int = 32, max_bytes: Optional[int] = 2 * 1024 ** 3,
+                 ttl: Optional[float] = 3600, name: str = 'index'):
+        super().__init__(max_items, max_bytes, ttl, name)
+        self._build_locks = {}
+
+    def get_or_build(self, key: Hashable, builder: Callable[[], Any]) -> Any:
+        """Возвращает индекс из кэша, а при его отсутствии строит ровно один раз,
+        даже если к документу одновременно обращаются несколько запросов."""
+        value = self.get(key)
+        metrics.record_cache(self.name, value is not None)
+        if value is not None:
+            return value
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            value = self.get(key)
+            if value is None:
+                value = builder()
+                self.put(key, value)
+        with self._lock:
+            self._build_locks.pop(key, None)
+        return value
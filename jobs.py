@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+READY = 'ready'
+FAILED = 'failed'
+
+# Доля общего прогресса, отводимая каждому этапу обработки документа
+STAGES = OrderedDict([
+    ('extracting', (0, 10)),
+    ('ocr', (10, 50)),
+    ('chunking', (50, 55)),
+    ('embedding', (55, 95)),
+    ('indexing', (95, 100)),
+])
+
+STAGE_MESSAGES = {
+    'extracting': 'Извлечение текста',
+    'ocr': 'OCR страницы {done} из {total}',
+    'chunking': 'Разбиение на чанки',
+    'embedding': 'Векторизация: {done} из {total} чанков',
+    'indexing': 'Построение индекса',
+}
+
+
+class IngestionJob:
+    """Задача обработки загруженного документа: извлечение текста и построение индекса.
+
+    on_update(status) получает to_dict() задачи при смене статуса и этапа и не чаще
+    раза в PUBLISH_INTERVAL секунд при смене прогресса внутри этапа, например, чтобы сохранить его
+    в общем для процессов приложения хранилище.
+    """
+
+    PUBLISH_INTERVAL = 0.5
+
+    def __init__(self, text_id: str, on_update: Optional[Callable[[Dict], None]] = None):
+        self.text_id = text_id
+        self.status = PENDING
+        self.stage = None
+        self.percent = 0
+        self.message = 'В очереди'
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.on_update = on_update
+        self._published_at = 0.0
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+
+    def progress(self, stage: str, done: int = 0, total: int = 0) -> None:
+        """Обновление этапа и процента выполнения; подходит как callback для этапов обработки."""
+        start, end = STAGES[stage]
+        fraction = done / total if total else 0
+        with self._lock:
+            publish = stage != self.stage
+            self.stage = stage
+            # Прогресс не уменьшается, даже если этапы сообщают о себе не по порядку
+            self.percent = max(self.percent, int(start + (end - start) * fraction))
+            self.message = STAGE_MESSAGES[stage].format(done=done, total=total)
+            self.updated_at = time.time()
+            publish = publish or self.updated_at - self._published_at >= self.PUBLISH_INTERVAL
+        if publish:
+            self._publish()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return self._to_dict()
+
+    def _to_dict(self) -> Dict:
+        return {
+            'text_id': self.text_id,
+            'status': self.status,
+            'stage': self.stage,
+            'percent': self.percent,
+            'message': self.message,
+            'error': self.error,
+        }
+
+    def _set_status(self, status: str, message: Optional[str] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.status = status
+            if message is not None:
+                self.message = message
+            if status == READY:
+                self.percent = 100
+            self.error = error
+            self.updated_at = time.time()
+        self._publish()
+
+    def _publish(self) -> None:
+        if not self.on_update:
+            return
+        # Статусы сохраняются по порядку: более ранний не перезапишет более поздний
+        with self._publish_lock:
+            with self._lock:
+                self._published_at = time.time()
+                status = self._to_dict()
+            try:
+                self.on_update(status)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении статуса задачи {self.text_id}: {str(e)}")
+
+
+class JobManager:
+    """Очередь задач обработки документов на пуле потоков.
+
+    Args:
+        max_workers: число документов, обрабатываемых одновременно
+        max_finished: сколько завершенных задач хранить для запросов статуса
+
+    on_update передается задачам, см. IngestionJob.
+    """
+
+    def __init__(self, max_workers: int = 2, max_finished: int = 1000):
+        self.max_workers = max_workers
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest')
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.on_update: Optional[Callable[[Dict], None]] = None
+
+    def submit(self, text_id: str, task: Callable[[IngestionJob], None]) -> IngestionJob:
+        """Ставит задачу в очередь; task получает объект задачи для сообщения о прогрессе."""
+        job = IngestionJob(text_id, self.on_update)
+        with self._lock:
+            self._jobs[text_id] = job
+            self._trim()
+        job._publish()
+        self._executor.submit(self._run, job, task)
+        return job
+
+    def get(self, text_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(text_id)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job: IngestionJob, task: Callable[[IngestionJob], None]) -> None:
+        job._set_status(RUNNING, message='Обработка начата')
+        try:
+            task(job)
+            job._set_status(READY, message='Документ готов')
+            logger.info(f"Документ {job.text_id} обработан")
+        except Exception as e:
+            logger.error(f"Ошибка при обработке документа {job.text_id}: {str(e)}")
+            job._set_status(FAILED, message='Ошибка обработки', error=str(e))
+
+    def _trim(self) -> None:
+        finished = [text_id for text_id, job in self._jobs.items() if job.status in (READY, FAILED)]
+        for text_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[text_id]
@@ -0,0 +1,66 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Числа с разделителями (15.3, 10,5, 01/2024) сохраняются одним токеном,
+# чтобы номера статей, даты и суммы находились точно
+TOKEN_PATTERN = re.compile(r'\d+(?:[.,/-]\d+)*|\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбиение текста на токены для лексического поиска."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Инвертированный индекс чанков документа с ранжированием BM25.
+
+    Args:
+        texts: тексты чанков в порядке строк индекса
+        k1, b: параметры BM25
+    """
+
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.size = len(texts)
+        self.doc_lengths = np.zeros(self.size, dtype='float32')
+
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.doc_lengths[row] = sum(counts.values())
+            for term, count in counts.items():
+                postings[term].append((row, count))
+
+        self.avg_length = float(self.doc_lengths.mean()) if self.size else 0.0
+        # Для каждого термина — массивы строк и частот, idf
+        self.postings = {}
+        for term, entries in postings.items():
+            rows = np.fromiter((row for row, _ in entries), dtype='int32', count=len(entries))
+            freqs = np.fromiter((count for _, count in entries), dtype='float32', count=len(entries))
+            idf = math.log(1 + (self.size - len(entries) + 0.5) / (len(entries) + 0.5))
+            self.postings[term] = (rows, freqs, idf)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """Возвращает до top_k пар (строка индекса, оценка BM25) в порядке убывания оценки."""
+        scores = np.zeros(self.size, dtype='float32')
+        matched = False
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / (self.avg_length or 1.0))
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            rows, freqs, idf = entry
+            scores[rows] += idf * freqs * (self.k1 + 1) / (freqs + norm[rows])
+            matched = True
+
+        if not matched:
+            return []
+        top_k = min(top_k, int(np.count_nonzero(scores)))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(row), float(scores[row])) for row in best]
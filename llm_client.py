@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+import ollama
+
+logger = logging.getLogger(__name__)
+
+# Коды ответа, при которых запрос имеет смысл повторить
+TRANSIENT_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class LLMError(Exception):
+    """Ошибка обращения к LLM."""
+
+
+class LLMBusyError(LLMError):
+    """Все слоты генерации заняты дольше допустимого времени ожидания."""
+
+
+class LLMTimeoutError(LLMError):
+    """Генерация не уложилась в отведенное время."""
+
+
+class LLMClient:
+    """Клиент Ollama с переиспользованием соединений и ограничением нагрузки.
+
+    Один ollama.Client (и его пул HTTP-соединений httpx) используется всеми запросами.
+    Число одновременных генераций ограничено семафором, у каждого запроса есть таймаут,
+    а временные ошибки (сеть, 429, 5xx) повторяются с экспоненциальной задержкой.
+
+    Args:
+        host: адрес сервера Ollama (по умолчанию берется из OLLAMA_HOST)
+        timeout: таймаут генерации в секундах
+        max_concurrency: максимальное число одновременных генераций
+        acquire_timeout: сколько ждать свободного слота генерации, секунд
+        max_retries: число повторов при временных ошибках
+        backoff: начальная задержка перед повтором, секунд (удваивается с каждой попыткой)
+    """
+
+    def __init__(self, host: Optional[str] = None, timeout: float = 120.0,
+                 max_concurrency: int = 4, acquire_timeout: float = 30.0,
+                 max_retries: int = 2, backoff: float = 0.5):
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._client = ollama.Client(
+            host=host,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 10.0)),
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    def chat(self, model: str, messages: List[Dict[str, str]]) -> Dict:
+        """Генерация ответа целиком."""
+        self._acquire()
+        try:
+            return self._with_retries(lambda: self._client.chat(model=model, messages=messages))
+        finally:
+            self._semaphore.release()
+
+    def stream_chat(self, model: str, messages: List[Dict[str, str]]) -> Iterator[Dict]:
+        """
+        Потоковая генерация ответа.
+        Повтор выполняется, только пока не получен первый фрагмент ответа.
+        Закрытие генератора (например, при отключении клиента) прерывает генерацию.
+        """
+        self._acquire()
+        stream = None
+        try:
+            deadline = time.monotonic() + self.timeout
+
+            def start():
+                parts = self._client.chat(model=model, messages=messages, stream=True)
+                try:
+                    return parts, next(parts, None)
+                except Exception:
+                    parts.close()
+                    raise
+
+            stream, first = self._with_retries(start)
+            if first is not None:
+                yield first
+            for part in stream:
+                if time.monotonic() > deadline:
+                    raise LLMTimeoutError(f"Генерация не завершилась за {self.timeout} с")
+                yield part
+        except httpx.TimeoutException as e:
+            raise LLMTimeoutError(f"Превышено время ожидания ответа LLM: {str(e)}") from e
+        except (httpx.HTTPError, ollama.ResponseError) as e:
+            raise LLMError(f"Ошибка обращения к LLM: {str(e)}") from e
+        finally:
+            if stream is not None:
+                # Закрывает HTTP-ответ, соединение возвращается в пул
+                stream.close()
+            self._semaphore.release()
+
+    def close(self) -> None:
+        self._client._client.close()
+
+    def _acquire(self) -> None:
+        if not self._semaphore.acquire(timeout=self.acquire_timeout):
+            raise LLMBusyError("Превышено число одновременных запросов к LLM")
+
+    def _with_retries(self, call):
+        attempt = 0
+        while True:
+            try:
+                return call()
+            except Exception as e:
+                if not self._is_transient(e) or attempt >= self.max_retries:
+                    if isinstance(e, httpx.TimeoutException):
+                        raise LLMTimeoutError(f"Превышено время ожидания ответа LLM: {str(e)}") from e
+                    if isinstance(e, LLMError):
+                        raise
+                    raise LLMError(f"Ошибка обращения к LLM: {str(e)}") from e
+                delay = self.backoff * 2 ** attempt
+                attempt += 1
+                logger.warning(f"Временная ошибка LLM ({str(e)}), повтор {attempt} через {delay:.1f} с")
+                time.sleep(delay)
+
+    @staticmethod
+    def _is_transient(error: Exception) -> bool:
+        if isinstance(error, ollama.ResponseError):
+            return error.status_code in TRANSIENT_STATUS_CODES
+        return isinstance(error, (httpx.TransportError, ConnectionError))
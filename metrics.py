@@ -0,0 +1,282 @@
+import contextvars
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+# Границы гистограмм времени этапов, секунды: от миллисекунд (поиск) до минут (OCR, генерация)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Строки значений метрики в текстовом формате Prometheus."""
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}', *self.samples()]
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                    for key, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """Текущее значение. Значения можно не хранить, а вычислять при чтении метрик через set_function."""
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        """function() возвращает словарь {значения меток: значение}."""
+        self._function = function
+
+    def samples(self) -> List[str]:
+        if self._function is None:
+            return super().samples()
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in sorted(self._function().items())]
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Для каждого набора меток: [число наблюдений по корзинам, сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def summary(self, **labels) -> Dict[str, float]:
+        """Количество и сумма наблюдений для набора меток."""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return {'count': entry[2], 'sum': entry[1]} if entry else {'count': 0, 'sum': 0.0}
+
+    def summaries(self) -> Dict[Tuple[str, ...], Dict[str, float]]:
+        """Количество и сумма наблюдений для всех наборов меток."""
+        with self._lock:
+            return {key: {'count': count, 'sum': total} for key, (_, total, count) in self._values.items()}
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса с выводом в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'rag_stage_seconds', 'Время этапов обработки документов и запросов, секунды', ['stage'])
+CACHE_REQUESTS = registry.counter(
+    'rag_cache_requests_total', 'Обращения к кэшам по результату (hit, miss)', ['cache', 'result'])
+IN_FLIGHT = registry.gauge(
+    'rag_in_flight', 'Число выполняющихся операций', ['operation'])
+HTTP_REQUESTS = registry.counter(
+    'rag_http_requests_total', 'HTTP-запросы по эндпоинту и коду ответа', ['endpoint', 'status'])
+HTTP_SECONDS = registry.histogram(
+    'rag_http_request_seconds', 'Время обработки HTTP-запросов, секунды', ['endpoint'])
+ERRORS = registry.counter(
+    'rag_errors_total', 'Ошибки по этапам', ['stage'])
+
+T = TypeVar('T')
+
+# Время этапов текущего запроса, мс; None — запрос не отслеживается
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    'request_timings', default=None)
+
+
+def start_request() -> None:
+    """Начало отслеживания этапов текущего запроса (вызывается в начале обработки HTTP-запроса)."""
+    _request_timings.set({})
+
+
+def request_timings() -> Dict[str, float]:
+    """Время этапов текущего запроса, мс (повторяющиеся этапы суммируются)."""
+    return dict(_request_timings.get() or {})
+
+
+def observe(stage: str, seconds: float) -> None:
+    """Запись времени этапа в гистограмму и в разбивку текущего запроса."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Замер времени этапа; исключения учитываются в rag_errors_total."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=stage)
+        raise
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+_active_iterators = threading.local()
+
+
+def timed_iter(stage: str, iterable: Iterable[T]) -> Iterator[T]:
+    """Замер времени, затраченного на получение элементов итератора.
+
+    Учитывается только время внутри next(), без обработки элементов потребителем,
+    поэтому этапы потоковой обработки (извлечение текста -> разбиение на чанки)
+    измеряются раздельно. Время вложенных timed_iter из времени этапа вычитается.
+    """
+    stack = getattr(_active_iterators, 'stack', None)
+    if stack is None:
+        stack = _active_iterators.stack = []
+    iterator = iter(iterable)
+    total = 0.0
+    try:
+        while True:
+            # [время вложенных этапов] для текущего вызова next()
+            stack.append([0.0])
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            except Exception:
+                ERRORS.inc(stage=stage)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = stack.pop()[0]
+                total += elapsed - nested
+                if stack:
+                    stack[-1][0] += elapsed
+            yield item
+    finally:
+        observe(stage, total)
+
+
+@contextmanager
+def in_flight(operation: str) -> Iterator[None]:
+    IN_FLIGHT.inc(operation=operation)
+    try:
+        yield
+    finally:
+        IN_FLIGHT.dec(operation=operation)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
@@ -0,0 +1,42 @@
+"""Функции процессов OCR.
+
+Модуль импортирует только то, что нужно для растеризации и распознавания страниц:
+процессы пула OCR не загружают модели и состояние приложения."""
+import os
+import time
+from typing import Optional, Tuple
+
+import pytesseract
+from pdf2image import convert_from_path
+
+
+def init_worker(tesseract_cmd_path: Optional[str]) -> None:
+    """Инициализация процесса OCR: каждый процесс занимает одно ядро"""
+    os.environ['OMP_THREAD_LIMIT'] = '1'
+    if tesseract_cmd_path:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd_path
+
+
+def ocr_pdf_page(pdf_path: str, page_num: int, dpi: int,
+                 poppler_path: Optional[str]) -> Tuple[int, str, Optional[str], float]:
+    """
+    Растеризация и OCR одной страницы PDF.
+    В памяти одновременно находится только изображение этой страницы.
+
+    Returns:
+        (номер страницы, текст, текст ошибки или None, время обработки в секундах)
+    """
+    start = time.perf_counter()
+    try:
+        images = convert_from_path(pdf_path, dpi=dpi, first_page=page_num, last_page=page_num,
+                                   grayscale=True, poppler_path=poppler_path)
+        page_text = ""
+        for image in images:
+            # Конвертируем в оттенки серого для лучшего распознавания
+            if image.mode != 'L':
+                image = image.convert('L')
+            page_text += pytesseract.image_to_string(image, lang='rus+eng')
+            image.close()
+        return page_num, page_text, None, time.perf_counter() - start
+    except Exception as e:
+        return page_num, "", str(e), time.perf_counter() - start
@@ -1,36 +1,117 @@
-from typing import Any, Dict, List
+import hashlib
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
+import faiss
 import numpy as np
-import pandas as pd
-from datasets import Dataset
-from sentence_transformers import SentenceTransformer
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+import metrics
+from batching import query_encoder
+from context_builder import ContextBuilder
+from embeddings import DEFAULT_MODEL, DEFAULT_RERANKER, model_registry
+from lexical import BM25Index
 
-class SemanticSearch:
-    def __init__(self, text, query, model = 'ai-forever/ru-en-RoSBERTa'):
-        """Инициализация модели для создания эмбеддингов."""
+RETRIEVAL_MODES = ('dense', 'lexical', 'hybrid')
+
+# Тип хранения векторов в FAISS-индексе
+VECTOR_DTYPES = ('float32', 'float16', 'int8')
+SCALAR_QUANTIZERS = {
+    'float16': faiss.ScalarQuantizer.QT_fp16,
+    'int8': faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def make_flat_index(dim: int, vector_dtype: str = 'float32') -> faiss.Index:
+    """Точный индекс L2 с векторами float32 или сжатыми скалярным квантованием до float16/int8.
+    Индекс int8 перед добавлением векторов нужно обучить (train) на них же."""
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Тип векторов {vector_dtype} не поддерживается, используйте {VECTOR_DTYPES}")
+    if vector_dtype == 'float32':
+        return faiss.IndexFlatL2(dim)
+    return faiss.IndexScalarQuantizer(dim, SCALAR_QUANTIZERS[vector_dtype], faiss.METRIC_L2)
+
+
+class DocumentIndex:
+    """Поисковый индекс одного документа: чанки, матрица эмбеддингов и FAISS-индекс.
+
+    Строится один раз при загрузке документа и переиспользуется для всех вопросов к нему.
+    Эмбеддинги хранятся одним непрерывным массивом и добавляются в FAISS напрямую,
+    метаданные чанков — в параллельных массивах с тем же порядком строк.
+    При vector_dtype float16 или int8 FAISS хранит сжатые векторы, а матрица эмбеддингов — float16.
+    """
+
+    def __init__(self, text, model = DEFAULT_MODEL, device = None,
+                 chunk_size: int = 500, chunk_overlap: int = 30,
+                 chunks: Optional[List[Dict]] = None, embeddings: Optional[np.ndarray] = None,
+                 faiss_index_path: Optional[str] = None,
+                 progress: Optional[Callable[[str, int, int], None]] = None,
+                 backend: Optional[str] = None, vector_dtype: str = 'float32',
+                 faiss_index: Optional[faiss.Index] = None):
+        """Готовые chunks, embeddings и faiss_index_path передаются при загрузке индекса из кэша,
+        готовый faiss_index — при обновлении текста документа (update).
+        progress(stage, done, total) вызывается на этапах chunking, embedding и indexing.
+        backend — бэкенд модели эмбеддингов (по умолчанию — из реестра моделей)."""
+        if vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Тип векторов {vector_dtype} не поддерживается, используйте {VECTOR_DTYPES}")
         self.text = text
-        self.model = SentenceTransformer(model)
-        self.chunks = self.chunk_text()
-        self.df = self.embed_chunks()
-        self.query = query
-        self.question_embedding = self.embed_query(query)
-        self.embeddings_dataset = self.initialize_index()
-        self.results = self.search()
+        self._text_hash = None
+        self.model_name = model
+        self.device = device
+        self.backend = backend or model_registry.backend
+        self.vector_dtype = vector_dtype
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.progress = progress
+        self._report('chunking', 0, 0)
+        self.chunks = chunks if chunks is not None else self.chunk_text(chunk_size, chunk_overlap)
+        self.texts = [chunk["text"] for chunk in self.chunks]
+        self.positions = np.array([chunk["chunk_info"]["position"] for chunk in self.chunks], dtype="int32")
+        self.sizes = np.array([chunk["chunk_info"]["size_chars"] for chunk in self.chunks], dtype="int32")
+        # Лексический индекс строится вместе с чанками, он дешевле векторизации
+        self.lexical_index = BM25Index(self.texts)
+        self.embeddings = embeddings if embeddings is not None else self.embed_chunks()
+        if vector_dtype != 'float32' and self.embeddings.dtype == np.float32:
+            self.embeddings = self.embeddings.astype('float16')
+        self._report('indexing', 0, 0)
+        # Индекс, загруженный с диска, отображен из файла и доступен только для чтения
+        self.index_mapped = faiss_index is None and bool(faiss_index_path)
+        self.faiss_index = faiss_index if faiss_index is not None else self.initialize_index(faiss_index_path)
+        self.progress = None
+
+    @property
+    def text_hash(self) -> str:
+        """SHA-256 текста документа."""
+        if self._text_hash is None:
+            self._text_hash = hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+        return self._text_hash
+
+    @property
+    def model(self):
+        """Модель из общего реестра; индекс, загруженный из кэша, не требует ее до первого вопроса."""
+        return model_registry.get(self.model_name, self.device, self.backend)
+
+    @property
+    def nbytes(self) -> int:
+        """Оценка занимаемой индексом памяти в байтах."""
+        text_bytes = len(self.text.encode("utf-8"))
+        chunks_bytes = sum(len(text.encode("utf-8")) for text in self.texts)
+        # Матрица эмбеддингов и копия векторов внутри FAISS
+        index_bytes = self.faiss_index.ntotal * self.faiss_index.code_size
+        return text_bytes + chunks_bytes + self.embeddings.nbytes + index_bytes
 
     def chunk_text(self, chunk_size: int = 500, 
                    chunk_overlap: int = 30) -> Dict[str, List[Dict]]:
         """Разбиене текста документа на чанки."""
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
+        with metrics.timed('chunking'):
+            return self.chunk_records(list(chunk_stream([self.text], chunk_size, chunk_overlap)))
 
+    @staticmethod
+    def chunk_records(text_chunks: List[str]) -> List[Dict]:
+        """Чанки с метаданными в формате DocumentIndex.chunks."""
         chunks = []
-        text_chunks = splitter.split_text(self.text)
         for i, chunk in enumerate(text_chunks):
             chunk_data = {
                 'text': chunk,
@@ -44,70 +125,309 @@ class SemanticSearch:
 
         return chunks
 
-    def embed_chunks(self) -> pd.DataFrame:
-        """Преобразование чанков документа в эмбеддинги."""
-        df = pd.DataFrame(self.chunks)
-        embeddings = self.model.encode(
-            df["text"].tolist(),
-            prompt_name="search_document",
-            show_progress_bar=True
+    def embed_chunks(self, batch_size: int = 256, texts: Optional[List[str]] = None) -> np.ndarray:
+        """Преобразование чанков документа (или переданных texts) в эмбеддинги.
+
+        Чанки кодируются порциями по batch_size, чтобы сообщать о прогрессе.
+        """
+        texts = self.texts if texts is None else texts
+        total = len(texts)
+        embeddings = None
+        model = self.model
+        with metrics.in_flight('embedding'), metrics.timed('embedding'):
+            for start in range(0, total, batch_size):
+                self._report('embedding', start, total)
+                batch = model.encode(
+                    texts[start:start + batch_size],
+                    prompt_name="search_document",
+                    convert_to_numpy=True,
+                    batch_size=model_registry.batch_size,
+                    show_progress_bar=self.progress is None
+                )
+                if embeddings is None:
+                    embeddings = np.empty((total, batch.shape[1]), dtype="float32")
+                embeddings[start:start + len(batch)] = batch
+        self._report('embedding', total, total)
+        return embeddings
+
+    @staticmethod
+    def chunk_hash(text: str) -> str:
+        """Хэш содержимого чанка, по которому переиспользуются эмбеддинги."""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def update(self, text: str, chunks: Optional[List[Dict]] = None,
+               progress: Optional[Callable[[str, int, int], None]] = None) -> Tuple["DocumentIndex", Dict[str, int]]:
+        """Индекс новой версии текста документа.
+
+        Эмбеддинги чанков, текст которых не изменился (совпадает хэш содержимого), берутся
+        из текущего индекса, векторизуются только новые и измененные чанки. Из копии
+        FAISS-индекса удаляются векторы исчезнувших чанков и добавляются векторы новых,
+        поэтому время обновления пропорционально изменению, а текущий индекс остается
+        неизменным и доступным для поиска до замены. Лексический индекс строится заново —
+        это дешевле векторизации.
+
+        Args:
+            chunks: чанки нового текста, если они уже получены (например, при извлечении из файла)
+
+        Returns:
+            (новый индекс, статистика: chunks, reused, embedded, removed)
+        """
+        if chunks is None:
+            if progress:
+                progress('chunking', 0, 0)
+            with metrics.timed('chunking'):
+                chunks = self.chunk_records(list(chunk_stream([text], self.chunk_size, self.chunk_overlap)))
+        if not chunks:
+            raise ValueError("Новый текст документа пуст")
+
+        # Строки текущего индекса по хэшу чанка; повторяющиеся чанки переиспользуются по одному разу
+        rows_by_hash = defaultdict(list)
+        for row, chunk_text in reversed(list(enumerate(self.texts))):
+            rows_by_hash[self.chunk_hash(chunk_text)].append(row)
+        kept, added = [], []
+        for chunk in chunks:
+            rows = rows_by_hash.get(self.chunk_hash(chunk["text"]))
+            if rows:
+                kept.append((rows.pop(), chunk))
+            else:
+                added.append(chunk)
+        # После remove_ids оставшиеся векторы FAISS сохраняют прежний порядок строк,
+        # новые добавляются в конец — в том же порядке идут чанки нового индекса
+        kept.sort(key=lambda item: item[0])
+        kept_rows = np.array([row for row, _ in kept], dtype="int64")
+        removed_rows = np.setdiff1d(np.arange(len(self.texts), dtype="int64"), kept_rows)
+
+        added_embeddings = None
+        if added:
+            previous_progress, self.progress = self.progress, progress
+            try:
+                added_embeddings = self.embed_chunks(texts=[chunk["text"] for chunk in added])
+            finally:
+                self.progress = previous_progress
+
+        if progress:
+            progress('indexing', 0, 0)
+        with metrics.timed('index_update'):
+            # clone_index не копирует коды индекса, отображенного из файла, поэтому он копируется через сериализацию
+            faiss_index = (faiss.deserialize_index(faiss.serialize_index(self.faiss_index)) if self.index_mapped
+                           else faiss.clone_index(self.faiss_index))
+            if len(removed_rows):
+                faiss_index.remove_ids(removed_rows)
+            embeddings = np.asarray(self.embeddings[kept_rows], dtype=self.embeddings.dtype)
+            if added_embeddings is not None:
+                faiss_index.add(added_embeddings)
+                embeddings = np.concatenate([embeddings, added_embeddings.astype(embeddings.dtype)])
+
+        index = DocumentIndex(
+            text, model=self.model_name, device=self.device,
+            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap,
+            chunks=[chunk for _, chunk in kept] + added, embeddings=embeddings,
+            faiss_index=faiss_index, backend=self.backend, vector_dtype=self.vector_dtype,
         )
-        df["embeddings"] = list(embeddings)
-        return df
-    
-    def initialize_index(self): 
-        """Создание FAISS-индексов для семантического поиска."""
-        embeddings_dataset = Dataset.from_pandas(self.df)
-        embeddings_dataset.add_faiss_index(column="embeddings")
-        return embeddings_dataset
+        stats = {"chunks": len(chunks), "reused": len(kept), "embedded": len(added), "removed": len(removed_rows)}
+        return index, stats
+
+    def _report(self, stage: str, done: int, total: int) -> None:
+        if self.progress:
+            self.progress(stage, done, total)
+
+    def initialize_index(self, faiss_index_path: Optional[str] = None) -> faiss.Index:
+        """Создание FAISS-индекса для семантического поиска."""
+        if faiss_index_path:
+            # Коды векторов не копируются в память процесса, а отображаются из файла (mmap):
+            # процессы приложения, открывшие один индекс, используют общие страницы
+            return faiss.read_index(faiss_index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+
+        with metrics.timed('index_build'):
+            vectors = np.ascontiguousarray(self.embeddings, dtype="float32")
+            faiss_index = make_flat_index(vectors.shape[1], self.vector_dtype)
+            if not faiss_index.is_trained:
+                faiss_index.train(vectors)
+            faiss_index.add(vectors)
+        return faiss_index
+
+    def save_faiss_index(self, path: str) -> None:
+        """Сериализация FAISS-индекса в файл."""
+        faiss.write_index(self.faiss_index, path)
 
     def embed_query(self, query: str) -> List[float]:
-        """Преобразование поискового запроса в эмбеддинг."""
-        return self.model.encode(query, prompt_name="search_query")
+        """Преобразование поискового запроса в эмбеддинг.
+        Вопросы одновременных запросов векторизуются общим батчем."""
+        return query_encoder.encode(query, self.model_name, self.device, self.backend)
 
     def search(
         self,
+        question_embedding,
         top_k: int = 5,
     ) -> List[Dict[str, Any]]:
         """Возвращает top_k наиболее релевантных чанков документа."""
 
-        if isinstance(self.question_embedding, np.ndarray) and self.question_embedding.size == 0:
+        if isinstance(question_embedding, np.ndarray) and question_embedding.size == 0:
             raise ValueError("Пустой эмбеддинг запроса")
 
-        if "embeddings" not in self.embeddings_dataset._indexes:
+        if self.faiss_index is None or self.faiss_index.ntotal == 0:
             raise ValueError("FAISS-индекс не инициализирован")
 
-        query_vector = np.array(self.question_embedding, dtype="float32")
+        query_vector = np.array(question_embedding, dtype="float32").reshape(1, -1)
 
-        scores, samples = self.embeddings_dataset.get_nearest_examples(
-            "embeddings",
-            query_vector,
-            k=top_k,
-        )
+        scores, ids = self.faiss_index.search(query_vector, min(top_k, self.faiss_index.ntotal))
 
-        results = []
-        for score, text, info in zip(
-            scores,
-            samples["text"],
-            samples["chunk_info"],
-        ):
-            results.append(
-                {
-                    "text": text,
-                    "score": float(score),
-                    "position": info["position"],
-                    "chunk_size": info["size_chars"],
-                }
-            )
+        return [self._result(idx, score) for score, idx in zip(scores[0], ids[0]) if idx >= 0]
 
-        return results
-    
-    def context_preparation(self) -> str:
-        """Подготовка контекста из результатов поиска для передачи в модель ответа."""
-        context_parts = []
-        for res in self.results:
-            context_parts.append(res["text"])
-        return "\n\n".join(context_parts)
+    def lexical_search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Возвращает top_k чанков по BM25; находит точные совпадения номеров, сумм и терминов."""
+        return [self._result(idx, score) for idx, score in self.lexical_index.search(query, top_k)]
+
+    def _result(self, idx: int, score: float) -> Dict[str, Any]:
+        return {
+            "text": self.texts[idx],
+            "score": float(score),
+            "position": int(self.positions[idx]),
+            "chunk_size": int(self.sizes[idx]),
+        }
+
+
+def chunk_stream(segments: Iterable[str], chunk_size: int = 500, chunk_overlap: int = 30,
+                 window_chunks: int = 64) -> Iterator[str]:
+    """Разбиение потока фрагментов текста на чанки без сборки всего текста в одну строку.
+
+    Текст накапливается в буфере и разбивается окнами примерно по window_chunks чанков;
+    последний чанк окна, который может быть обрезан границей окна, переносится в следующее.
+    Результат зависит только от текста, а не от того, как он разбит на фрагменты.
+    """
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=["\n\n", "\n", ". ", " ", ""]
+    )
+    window = max(2, window_chunks) * chunk_size
+    buffer, offset = "", 0
+    for segment in segments:
+        # Сдвиг по буферу вместо его копирования после каждого окна
+        buffer = buffer[offset:] + segment
+        offset = 0
+        while len(buffer) - offset > window:
+            piece = buffer[offset:offset + window]
+            text_chunks = splitter.split_text(piece)
+            start = piece.rfind(text_chunks[-1]) if text_chunks else -1
+            if start <= 0:
+                yield from text_chunks
+                offset += window
+                continue
+            yield from text_chunks[:-1]
+            offset += start
+    yield from splitter.split_text(buffer[offset:])
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[List[Dict[str, Any]]],
+                           names: Sequence[str] = ("dense", "lexical"),
+                           k: int = 60) -> List[Dict[str, Any]]:
+    """Объединение нескольких ранжированных списков методом reciprocal rank fusion.
+
+    Оценка чанка — сумма 1 / (k + ранг) по спискам, в которых он встретился;
+    исходные оценки сохраняются в полях <name>_score.
+    """
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for name, results in zip(names, result_lists):
+        for rank, res in enumerate(results, 1):
+            key = (res.get("text_id"), res["position"])
+            item = fused.setdefault(key, {**res, "score": 0.0})
+            item["score"] += 1.0 / (k + rank)
+            item[f"{name}_score"] = res["score"]
+    return sorted(fused.values(), key=lambda res: res["score"], reverse=True)
+
+
+class SemanticSearch:
+    def __init__(self, text, query, model = DEFAULT_MODEL, device = None,
+                 index: Optional[DocumentIndex] = None, top_k: int = 5,
+                 mode: str = 'hybrid', candidates: int = 20,
+                 rerank: bool = False, reranker_model: str = DEFAULT_RERANKER,
+                 backend: Optional[str] = None):
+        """Поиск релевантных вопросу чанков документа.
+
+        Если передан готовый index, документ повторно не разбивается и не векторизуется:
+        вычисляется только эмбеддинг вопроса.
+
+        Args:
+            mode: 'dense' — векторный поиск, 'lexical' — BM25, 'hybrid' — объединение обоих через RRF
+            candidates: сколько кандидатов брать из каждого поиска для объединения и переранжирования
+            rerank: переранжировать кандидатов моделью cross-encoder reranker_model
+            backend: бэкенд модели эмбеддингов (torch, onnx, onnx-int8) для построения индекса
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Режим поиска {mode} не поддерживается, используйте {RETRIEVAL_MODES}")
+        self.text = text
+        self.index = index if index is not None else DocumentIndex(text, model, device, backend=backend)
+        self.model = self.index.model
+        self.chunks = self.index.chunks
+        self.query = query
+        self.mode = mode
+        self.candidates = candidates
+        self.rerank = rerank
+        self.reranker_model = reranker_model
+        self.device = device
+        # Время этапов поиска, мс
+        self.timings: Dict[str, float] = {}
+        self.context_stats: Dict[str, int] = {}
+        with self._timed('embed_query'):
+            self.question_embedding = self.index.embed_query(query)
+        self.results = self.search(top_k)
+
+    @contextmanager
+    def _timed(self, stage: str):
+        """Замер этапа поиска: в timings и в метрики этапа search_<stage>."""
+        start = time.perf_counter()
+        try:
+            with metrics.timed(f'search_{stage}'):
+                yield
+        finally:
+            self.timings[stage] = (time.perf_counter() - start) * 1000
+
+    def search(self, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Возвращает top_k наиболее релевантных чанков документа."""
+        pool = max(top_k, self.candidates) if self.mode == 'hybrid' or self.rerank else top_k
+        dense, lexical = [], []
+
+        if self.mode in ('dense', 'hybrid'):
+            with self._timed('dense'):
+                dense = self.index.search(self.question_embedding, pool)
+        if self.mode in ('lexical', 'hybrid'):
+            with self._timed('lexical'):
+                lexical = self.index.lexical_search(self.query, pool)
+
+        if self.mode == 'hybrid':
+            with self._timed('fusion'):
+                results = reciprocal_rank_fusion([dense, lexical])
+        else:
+            results = dense or lexical
+
+        if self.rerank and results:
+            with self._timed('rerank'):
+                results = self.rerank_results(results)
+
+        return results[:top_k]
+
+    def rerank_results(self, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Переранжирование кандидатов моделью cross-encoder по паре (вопрос, чанк)."""
+        reranker = model_registry.get_reranker(self.reranker_model, self.device)
+        scores = reranker.predict([(self.query, res["text"]) for res in results])
+        for res, score in zip(results, scores):
+            res["rerank_score"] = float(score)
+        return sorted(results, key=lambda res: res["rerank_score"], reverse=True)
+
+    def context_preparation(self, token_budget: int = 2000) -> str:
+        """Подготовка контекста из результатов поиска для передачи в модель ответа.
+
+        Повторы отбрасываются, соседние чанки склеиваются без перекрытия, контекст
+        ограничивается token_budget токенами. Статистика сборки сохраняется в context_stats.
+        """
+        builder = ContextBuilder(tokenizer=getattr(self.model, 'tokenizer', None),
+                                 token_budget=token_budget,
+                                 chunk_overlap=getattr(self.index, 'chunk_overlap', 30))
+        with self._timed('context'):
+            context, self.context_stats = builder.build(self.results)
+        return context
     
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+"""
+Локальная заглушка сервера Ollama для проверки клиента LLM и нагрузочных тестов.
+
+Реализует POST /api/chat (обычный и потоковый режимы) и отвечает фиксированным текстом
+с настраиваемой задержкой и долей ошибок 503. Запуск:
+    python stub_ollama.py --port 11435 --token-delay 0.02
+    OLLAMA_HOST=http://127.0.0.1:11435 python app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = "Это ответ тестовой модели на вопрос по документу."
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Настройки задаются через атрибуты сервера
+    @property
+    def settings(self):
+        return self.server.settings
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/api/version':
+            self._send_json(200, {'version': '0.0.0-stub'})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/api/chat':
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        with self.server.lock:
+            self.server.requests += 1
+
+        if random.random() < self.settings['fail_rate']:
+            self._send_json(503, {'error': 'stub: service unavailable'})
+            return
+
+        time.sleep(self.settings['first_token_delay'])
+        tokens = self.settings['answer'].split(' ')
+        tokens = [token + ' ' for token in tokens[:-1]] + tokens[-1:]
+        model = request.get('model', 'stub')
+
+        if not request.get('stream', True):
+            time.sleep(self.settings['token_delay'] * len(tokens))
+            self._send_json(200, self._part(model, ''.join(tokens), done=True))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for token in tokens:
+                self._write_chunk(self._part(model, token, done=False))
+                time.sleep(self.settings['token_delay'])
+            self._write_chunk(self._part(model, '', done=True))
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент прервал генерацию
+            pass
+
+    @staticmethod
+    def _part(model: str, content: str, done: bool) -> dict:
+        part = {
+            'model': model,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'message': {'role': 'assistant', 'content': content},
+            'done': done,
+        }
+        if done:
+            part['done_reason'] = 'stop'
+        return part
+
+    def _write_chunk(self, data: dict) -> None:
+        body = (json.dumps(data, ensure_ascii=False) + '\n').encode('utf-8')
+        self.wfile.write(f'{len(body):x}\r\n'.encode() + body + b'\r\n')
+        self.wfile.flush()
+
+    def _send_json(self, status: int, data: dict) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_server(host: str = '127.0.0.1', port: int = 0, answer: str = DEFAULT_ANSWER,
+                      first_token_delay: float = 0.0, token_delay: float = 0.0,
+                      fail_rate: float = 0.0) -> ThreadingHTTPServer:
+    """Запускает заглушку в фоновом потоке; адрес — server.server_address. Остановка — server.shutdown()."""
+    server = ThreadingHTTPServer((host, port), StubOllamaHandler)
+    server.daemon_threads = True
+    server.settings = {
+        'answer': answer,
+        'first_token_delay': first_token_delay,
+        'token_delay': token_delay,
+        'fail_rate': fail_rate,
+    }
+    server.lock = threading.Lock()
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--answer', default=DEFAULT_ANSWER)
+    parser.add_argument('--first-token-delay', type=float, default=0.0)
+    parser.add_argument('--token-delay', type=float, default=0.0)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    stub = start_stub_server(args.host, args.port, args.answer,
+                             args.first_token_delay, args.token_delay, args.fail_rate)
+    print(f"Заглушка Ollama запущена на http://{args.host}:{stub.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.shutdown()
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Генераторы тестовых документов берутся из сквозного бенчмарка
+sys.path.insert(1, os.path.join(ROOT, 'benchmarks'))
+
+import stub_ollama  # noqa: E402
+from embeddings import model_registry  # noqa: E402
+
+EMBEDDING_MODEL = 'test-embedding'
+RERANKER_MODEL = 'test-reranker'
+
+FILLER = ("Стороны обязуются соблюдать условия настоящего соглашения, своевременно уведомлять "
+          "друг друга об изменении реквизитов и решать разногласия путем переговоров. ")
+
+
+class HashingModel:
+    """Модель эмбеддингов для тестов: мешок слов, хэшированный в 64 измерения."""
+    tokenizer = None
+    dim = 64
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, prompt_name=None, **kwargs):
+        single = isinstance(texts, str)
+        vectors = np.zeros((1 if single else len(texts), self.dim), dtype='float32')
+        for row, text in enumerate([texts] if single else texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % self.dim] += 1
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[0] if single else vectors
+
+
+class OverlapReranker:
+    """Cross-encoder для тестов: оценка — число общих слов вопроса и чанка."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def predict(self, pairs):
+        self.calls += 1
+        return np.array([len(set(query.lower().split()) & set(text.lower().split()))
+                         for query, text in pairs], dtype='float32')
+
+
+# Приложение настраивается переменными окружения при импорте, поэтому они задаются до него
+stub_server = stub_ollama.start_stub_server(answer='Ответ тестовой модели')
+os.environ.update({
+    'OLLAMA_HOST': f'http://127.0.0.1:{stub_server.server_address[1]}',
+    'CACHE_DIR': tempfile.mkdtemp(prefix='rag-tests-'),
+    'DOCUMENT_STORE': 'sqlite',
+    'EMBEDDING_MODEL': EMBEDDING_MODEL,
+    'RERANKER_MODEL': RERANKER_MODEL,
+    'EMBEDDING_WARM_UP': '0',
+})
+model_registry._models[(EMBEDDING_MODEL, None, 'embedding')] = HashingModel()
+reranker = OverlapReranker()
+model_registry._models[(RERANKER_MODEL, None, 'reranker')] = reranker
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+def paragraphs(*items) -> str:
+    """Текст, в котором каждый абзац становится отдельным чанком: абзацы длиннее
+    половины чанка не склеиваются разбиением в один."""
+    return "\n\n".join(item + " " + FILLER * 2 for item in items)
+
+
+def wait_for(client, job_id: str, timeout: float = 30) -> dict:
+    """Ожидание завершения задачи обработки документа; возвращает ее статус."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f'/status/{job_id}').get_json()
+        if status.get('status') in ('ready', 'failed'):
+            return status
+        time.sleep(0.02)
+    raise TimeoutError(job_id)
+
+
+@pytest.fixture
+def upload(client):
+    """Загрузка текста или файла через /upload с ожиданием готовности; возвращает text_id."""
+    def upload(text=None, file=None):
+        data = {'text': text} if text is not None else {'file': file}
+        response = client.post('/upload', data=data, content_type='multipart/form-data')
+        assert response.status_code == 202, response.get_json()
+        text_id = response.get_json()['text_id']
+        assert wait_for(client, text_id)['status'] == 'ready'
+        return text_id
+    return upload
@@ -0,0 +1,29 @@
+from conftest import RERANKER_MODEL, app_module, paragraphs, reranker
+from searching import SemanticSearch
+
+
+def test_ask_with_rerank(client, upload):
+    text_id = upload(paragraphs("Залог составляет две месячные платы.", "Арендная плата вносится ежемесячно.",
+                                "Договор заключен на один год."))
+    calls = reranker.calls
+
+    response = client.post('/ask', json={'text_id': text_id, 'question': 'какой залог по договору',
+                                         'rerank': True, 'debug': True, 'no_cache': True})
+
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['answer'] == 'Ответ тестовой модели'
+    assert 'rerank' in response.get_json()['retrieval_timings']
+    assert reranker.calls == calls + 1
+
+
+def test_rerank_orders_candidates_by_reranker_score(upload):
+    text_id = upload(paragraphs("Залог составляет две месячные платы.", "Арендная плата вносится ежемесячно.",
+                                "Договор заключен на один год."))
+    index = app_module.get_document_index(text_id)
+
+    results = SemanticSearch(None, 'залог составляет', index=index, top_k=3, rerank=True,
+                             reranker_model=RERANKER_MODEL).results
+
+    scores = [res['rerank_score'] for res in results]
+    assert scores == sorted(scores, reverse=True)
+    assert results[0]['text'].startswith('Залог составляет')
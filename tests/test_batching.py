@@ -0,0 +1,45 @@
+import threading
+import time
+
+from batching import BatchingEncoder, query_encoder
+from conftest import EMBEDDING_MODEL
+
+
+def test_single_query_does_not_wait_for_window():
+    encoder = BatchingEncoder(window_ms=2000)
+    try:
+        started = time.perf_counter()
+        vector = encoder.encode('какой залог', EMBEDDING_MODEL)
+        assert time.perf_counter() - started < 1
+    finally:
+        encoder.shutdown()
+    assert vector.shape == (64,)
+    assert encoder.stats()['batch_sizes'] == {1: 1}
+
+
+def test_waiting_queries_are_encoded_in_one_batch():
+    encoder = BatchingEncoder(window_ms=200)
+    # Пока поток не запущен, вопросы копятся в очереди
+    encoder._ensure_worker = lambda: None
+    threads = [threading.Thread(target=encoder.encode, args=(f'вопрос {i}', EMBEDDING_MODEL)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    while encoder._queue.qsize() < 4:
+        time.sleep(0.01)
+    del encoder._ensure_worker
+    encoder._ensure_worker()
+    for thread in threads:
+        thread.join()
+    encoder.shutdown()
+
+    assert encoder.stats()['batch_sizes'] == {4: 1}
+
+
+def test_batch_sizes_are_exported_in_metrics(client):
+    query_encoder.encode('какой залог', EMBEDDING_MODEL)
+
+    lines = client.get('/metrics').get_data(as_text=True).splitlines()
+
+    assert 'rag_query_queue_depth 0' in lines
+    assert any(line.startswith('rag_query_batch_size_bucket{le="64"} ') for line in lines)
+    assert any(line.startswith('rag_query_batch_size_count ') and int(line.split()[1]) >= 1 for line in lines)
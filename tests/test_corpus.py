@@ -0,0 +1,62 @@
+import numpy as np
+
+from conftest import app_module, paragraphs
+from corpus import CorpusIndex
+from searching import SemanticSearch
+
+
+def add(corpus, text_id, texts, vectors):
+    corpus.add_document(text_id, np.array(vectors, dtype='float32'), texts,
+                        positions=range(len(texts)), sizes=[len(text) for text in texts])
+
+
+def test_lexical_search_across_documents_finds_exact_terms():
+    corpus = CorpusIndex()
+    add(corpus, 'a', ['Штраф по статье 15.3 составляет 5000 рублей', 'Общие положения'],
+        [[0, 1], [1, 0]])
+    add(corpus, 'b', ['Порядок расторжения договора', 'Реквизиты сторон'],
+        [[0.9, 0.1], [0.5, 0.5]])
+
+    dense = corpus.search([1, 0], top_k=2, text_ids=['a', 'b'])
+    lexical = corpus.lexical_search('статья 15.3', top_k=2, text_ids=['a', 'b'])
+
+    assert [(res['text_id'], res['position']) for res in dense] == [('a', 1), ('b', 0)]
+    assert [(res['text_id'], res['position']) for res in lexical] == [('a', 0)]
+    assert corpus.lexical_search('статья 15.3', top_k=2, text_ids=['b']) == []
+
+
+def test_lexical_search_merges_documents_by_rank():
+    corpus = CorpusIndex()
+    add(corpus, 'a', ['аренда помещения', 'аренда аренда аренда оборудования'], [[1, 0], [0, 1]])
+    add(corpus, 'b', ['аренда транспорта'], [[1, 1]])
+
+    lexical = corpus.lexical_search('аренда', top_k=3)
+
+    # Лучшие чанки каждого документа идут раньше второго чанка документа a
+    assert {(res['text_id'], res['position']) for res in lexical[:2]} == {('a', 1), ('b', 0)}
+    assert (lexical[2]['text_id'], lexical[2]['position']) == ('a', 0)
+    assert all('lexical_score' in res for res in lexical)
+
+
+def test_multi_document_lexical_mode_changes_ranking(client, upload):
+    first = upload(paragraphs("Штраф по статье 15.3 составляет 5000 рублей.", "Порядок оплаты аренды.",
+                              "Сроки поставки товара."))
+    second = upload(paragraphs("Арендатор вносит залог.", "Статья 15.3 применяется к просрочке.",
+                               "Ответственность сторон."))
+    question = 'статья 15.3'
+
+    response = client.post('/ask', json={'text_ids': [first, second], 'question': question,
+                                         'retrieval': 'lexical', 'debug': True, 'no_cache': True})
+    assert response.status_code == 200
+    assert 'lexical' in response.get_json()['retrieval_timings']
+    assert 'dense' not in response.get_json()['retrieval_timings']
+
+    view = app_module.corpus_index.view([first, second])
+    dense = SemanticSearch(None, question, index=view, mode='dense').results
+    lexical = SemanticSearch(None, question, index=view, mode='lexical').results
+
+    assert [(res['text_id'], res['position']) for res in lexical] != \
+           [(res['text_id'], res['position']) for res in dense]
+    # Лексический поиск находит точный номер статьи в обоих документах и только там
+    assert {res['text_id'] for res in lexical} == {first, second}
+    assert all('15.3' in res['text'] for res in lexical)
@@ -0,0 +1,34 @@
+import sqlite3
+
+from document_store import SQLiteDocumentStore
+
+
+def test_sqlite_store_evicts_least_recently_used_documents(tmp_path):
+    store = SQLiteDocumentStore(str(tmp_path / 'documents.sqlite3'), max_bytes=250)
+    evicted = []
+    store.on_evict = evicted.append
+    store.ACCESS_RESOLUTION = 0
+
+    store.put('a', 'а' * 50)
+    store.put('b', 'б' * 50)
+    store.get_text('a')
+    store.put('c', 'в' * 50)
+
+    assert evicted == ['b']
+    assert 'b' not in store
+    assert store.get_text('a') and store.get_text('c')
+    assert store.stats()['bytes'] <= 250
+
+
+def test_sqlite_store_adds_last_access_to_existing_database(tmp_path):
+    path = str(tmp_path / 'documents.sqlite3')
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE documents (text_id TEXT PRIMARY KEY, text TEXT NOT NULL, "
+                           "meta TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL)")
+        connection.execute("INSERT INTO documents VALUES ('old', 'текст', '{}', 10, 1.0)")
+
+    store = SQLiteDocumentStore(path, max_bytes=15)
+    store.put('new', 'новый')
+
+    assert 'old' not in store
+    assert store.get_text('new') == 'новый'
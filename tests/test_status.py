@@ -0,0 +1,53 @@
+import threading
+
+from conftest import app_module, wait_for
+from document_store import SQLiteDocumentStore
+from jobs import JobManager
+
+
+def other_worker():
+    """Хранилище и очередь задач другого процесса приложения с той же базой sqlite."""
+    jobs = JobManager(max_workers=1)
+    jobs.on_update = SQLiteDocumentStore(app_module.document_store.path).put_job
+    return jobs
+
+
+def test_status_of_job_running_in_other_worker(client):
+    jobs = other_worker()
+    started, release = threading.Event(), threading.Event()
+
+    def task(job):
+        job.progress('embedding', 1, 4)
+        started.set()
+        release.wait(10)
+
+    jobs.submit('other-running', task)
+    assert started.wait(10)
+    assert app_module.job_manager.get('other-running') is None
+
+    status = client.get('/status/other-running').get_json()
+    assert status['status'] == 'running'
+    assert status['stage'] == 'embedding'
+    response = client.post('/ask', json={'text_id': 'other-running', 'question': 'какой залог'})
+    assert response.status_code == 409
+
+    release.set()
+    assert wait_for(client, 'other-running')['status'] == 'ready'
+    jobs.shutdown()
+
+
+def test_failed_job_of_other_worker_is_visible(client):
+    jobs = other_worker()
+
+    def task(job):
+        raise ValueError('Файл поврежден')
+
+    jobs.submit('other-failed', task)
+    jobs.shutdown()
+
+    status = client.get('/status/other-failed').get_json()
+    assert status['status'] == 'failed'
+    assert status['error'] == 'Файл поврежден'
+    response = client.get('/text/other-failed')
+    assert response.status_code == 422
+    assert 'Файл поврежден' in response.get_json()['error']
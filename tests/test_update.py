@@ -0,0 +1,42 @@
+import io
+
+import pypdf
+
+from bench_e2e import make_pdf
+from conftest import paragraphs, wait_for
+
+
+def pdf(text: str, pages: int):
+    """PDF с текстовым слоем заданного числа страниц и его имя для формы."""
+    data = make_pdf('\n\n'.join([text] * (pages * 25)))
+    assert len(pypdf.PdfReader(io.BytesIO(data)).pages) == pages
+    return io.BytesIO(data), 'document.pdf'
+
+
+def update(client, text_id, mode, text=None, file=None) -> dict:
+    """Обновление документа через PUT /text/<id> с ожиданием завершения; возвращает метаданные."""
+    data = {'mode': mode, **({'text': text} if text is not None else {'file': file})}
+    response = client.put(f'/text/{text_id}', data=data, content_type='multipart/form-data')
+    assert response.status_code == 202, response.get_json()
+    assert wait_for(client, response.get_json()['update_id'])['status'] == 'ready'
+    return client.get(f'/text/{text_id}').get_json()
+
+
+def test_replace_with_text_resets_pages(client, upload):
+    text_id = upload(file=pdf('Lease agreement terms and deposit rules.', 2))
+    assert client.get(f'/text/{text_id}').get_json()['pages'] == 2
+
+    assert update(client, text_id, 'replace', text=paragraphs('Новый текст договора.'))['pages'] is None
+
+
+def test_replace_with_file_takes_its_pages(client, upload):
+    text_id = upload(paragraphs('Текст без страниц.'))
+
+    assert update(client, text_id, 'replace', file=pdf('Supply contract delivery schedule.', 3))['pages'] == 3
+
+
+def test_append_sums_pages(client, upload):
+    text_id = upload(file=pdf('Service agreement payment terms.', 2))
+
+    assert update(client, text_id, 'append', file=pdf('Annex with penalties for late payment.', 1))['pages'] == 3
+    assert update(client, text_id, 'append', text=paragraphs('Дописанный абзац.'))['pages'] == 3
@@ -1,12 +1,21 @@
+import codecs
+import multiprocessing
 import os
 import re
 import tempfile
+import threading
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import pypdf
 import pytesseract
 from PIL import Image
 from docx import Document
-from pdf2image import convert_from_path
+from pdf2image import pdfinfo_from_path
+
+import metrics
+import ocr_worker
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,13 +25,47 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# progress(stage, done, total) — сообщение о ходе обработки документа
+ProgressCallback = Callable[[str, int, int], None]
+
+# Кодировки текстовых файлов в порядке проверки
+TXT_ENCODINGS = ['utf-8', 'cp1251', 'koi8-r', 'iso-8859-1']
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+# Сохраняем базовую пунктуацию, удаляем специальные символы
+SPECIAL_CHARS_PATTERN = re.compile(r'[^\w\s\n.,;:!?%-]')
+
+
+def _ocr_mp_context():
+    """Процессы OCR запускаются через forkserver (spawn, где его нет):
+    fork процесса приложения с работающими потоками небезопасен.
+    Сервер forkserver заранее импортирует только модуль ocr_worker."""
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['ocr_worker'])
+    return context
+
 
 class TextExtractor:
     """Класс для извлечения текста из загруженных файлов / инпута"""
     
-    def __init__(self, tesseract_cmd_path: str = None, poppler_path: str = None):
+    def __init__(self, tesseract_cmd_path: str = None, poppler_path: str = None,
+                 ocr_workers: Optional[int] = None, ocr_dpi: int = 300):
+        """
+        Args:
+            tesseract_cmd_path: путь к tesseract.exe
+            poppler_path: путь к poppler/bin
+            ocr_workers: число процессов для OCR страниц PDF (по умолчанию — число ядер);
+                пул процессов общий для всех одновременно обрабатываемых PDF
+            ocr_dpi: разрешение растеризации страниц PDF
+        """
         self.poppler_path = poppler_path
         self.tesseract_cmd_path = tesseract_cmd_path
+        self.ocr_workers = max(1, ocr_workers or os.cpu_count() or 1)
+        self.ocr_dpi = ocr_dpi
+        self._ocr_pool: Optional[ProcessPoolExecutor] = None
+        self._ocr_pool_lock = threading.Lock()
         self.supported_extensions = ['.txt', '.pdf', '.docx', '.doc',
                                     '.jpg', '.jpeg', '.png', '.bmp', '.tiff']
     
@@ -58,19 +101,11 @@ class TextExtractor:
                 file_storage.save(temp_path)
             
             try:
-                # Извлекаем текст в зависимости от типа файла
-                if ext == '.pdf':
-                    text = self._extract_from_pdf(temp_path)
-                elif ext in ['.docx', '.doc']:
-                    text = self._extract_from_docx(temp_path)
-                elif ext in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']:
-                    text = self._extract_from_image(temp_path)
-                elif ext == '.txt':
-                    text = self._extract_from_txt(temp_path)
-                
-                # Очищаем текст
-                cleaned_text = self._clean_text(text)
-                
+                # Извлекаем и очищаем текст в зависимости от типа файла
+                with metrics.in_flight('extraction'):
+                    cleaned_text = "".join(metrics.timed_iter(
+                        'extraction', self._iter_clean(self._iter_raw(temp_path, ext))))
+
                 logger.info(f"Успешно обработан файл {filename}, извлечено {len(cleaned_text)} символов")
                 return cleaned_text
                 
@@ -84,8 +119,24 @@ class TextExtractor:
             raise
 
 
-    def extract_from_path(self, file_path: str) -> str:
-        """Извлечение текста из файла по пути (для отладки)"""
+    def extract_from_path(self, file_path: str, progress: Optional[ProgressCallback] = None) -> str:
+        """
+        Извлечение текста из файла по пути
+
+        Args:
+            file_path: путь к файлу
+            progress: функция progress(stage, done, total) для отслеживания хода обработки
+        """
+        return "".join(self.iter_from_path(file_path, progress))
+
+    def iter_from_path(self, file_path: str, progress: Optional[ProgressCallback] = None,
+                       info: Optional[Dict] = None) -> Iterator[str]:
+        """
+        Потоковое извлечение текста из файла по пути: генератор очищенных фрагментов
+        (страниц, абзацев, блоков файла), которые вместе составляют текст документа.
+        Весь текст целиком в памяти не собирается.
+        В словарь info записывается число страниц ('pages'), если оно известно для формата.
+        """
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"Файл не найден: {file_path}")
@@ -96,71 +147,143 @@ class TextExtractor:
             if ext not in self.supported_extensions:
                 raise ValueError(f"Расширение {ext} не поддерживается")
             
-            # Обрабатываем в зависимости от типа
-            if ext == '.pdf':
-                text = self._extract_from_pdf(file_path)
-            elif ext in ['.docx', '.doc']:
-                text = self._extract_from_docx(file_path)
-            elif ext in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']:
-                text = self._extract_from_image(file_path)
-            
-            cleaned_text = self._clean_text(text)
-            
-            return cleaned_text
-            
+            if progress:
+                progress('extracting', 0, 0)
+
+            with metrics.in_flight('extraction'):
+                yield from metrics.timed_iter(
+                    'extraction', self._iter_clean(self._iter_raw(file_path, ext, progress, info)))
+
         except Exception as e:
             logger.error(f"Ошибка при обработке файла {file_path}: {str(e)}")
             raise
 
-    def _extract_from_pdf(self, pdf_path: str) -> str:
-        """Извлечение текста из файла PDF с использованием OCR при необходимости"""
-        try:
-            standard_text = self._extract_from_pdf_standard(pdf_path)
+    def _iter_raw(self, file_path: str, ext: str, progress: Optional[ProgressCallback] = None,
+                  info: Optional[Dict] = None) -> Iterator[str]:
+        """Фрагменты неочищенного текста в зависимости от типа файла"""
+        if ext == '.pdf':
+            return self._iter_from_pdf(file_path, progress, info)
+        if ext in ['.docx', '.doc']:
+            return self._iter_from_docx(file_path)
+        if ext in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']:
+            if info is not None:
+                info['pages'] = 1
+            return self._iter_from_image(file_path)
+        return self._iter_from_txt(file_path)
 
-            if standard_text:
-                logger.info(f"PDF содержит распознанный текст: {len(standard_text)} символов")
-                return standard_text
+    def extract_pdf_pages(self, pdf_path: str, progress: Optional[ProgressCallback] = None) -> List[Dict]:
+        """
+        Постраничное извлечение текста из PDF.
+        Страницы с текстовым слоем читаются через pypdf, OCR применяется
+        только к страницам без текста или с нераспознаваемым текстом.
+
+        Returns:
+            список {'page': номер страницы, 'text': текст, 'source': 'text' | 'ocr'} в порядке страниц
+        """
+        pages = self._extract_from_pdf_standard(pdf_path)
 
+        if pages is None:
+            logger.info("Текстовый слой PDF недоступен, применяется OCR ко всем страницам...")
+            ocr_pages = self._ocr_pdf_pages(pdf_path, progress=progress)
+            return [{'page': page_num, 'text': text, 'source': 'ocr'} for page_num, text in ocr_pages]
+
+        result = []
+        ocr_needed = []
+        for page_num, page_text in pages:
+            if self._has_text_layer(page_text):
+                result.append({'page': page_num, 'text': page_text, 'source': 'text'})
             else:
-                logger.info("Текст в PDF не распознан, применяется OCR...")
-                ocr_text = self._extract_from_pdf_with_ocr(pdf_path)
+                ocr_needed.append(page_num)
+
+        if ocr_needed:
+            logger.info(f"Страниц без текстового слоя: {len(ocr_needed)} из {len(pages)}, применяется OCR...")
+            for page_num, page_text in self._ocr_pdf_pages(pdf_path, ocr_needed, progress):
+                result.append({'page': page_num, 'text': page_text, 'source': 'ocr'})
+            result.sort(key=lambda page: page['page'])
 
-                combined_text = standard_text + "\n" + ocr_text if standard_text else ocr_text
-                logger.info(f"После OCR извлечено {len(combined_text)} символов")
-                return combined_text
+        return result
 
+    def _extract_from_pdf(self, pdf_path: str, progress: Optional[ProgressCallback] = None) -> str:
+        """Извлечение текста из файла PDF с использованием OCR при необходимости"""
+        return "".join(self._iter_from_pdf(pdf_path, progress))
+
+    def _iter_from_pdf(self, pdf_path: str, progress: Optional[ProgressCallback] = None,
+                       info: Optional[Dict] = None) -> Iterator[str]:
+        """Текст PDF по страницам, разделенным переводом строки"""
+        try:
+            pages = self.extract_pdf_pages(pdf_path, progress)
         except Exception as e:
             logger.error(f"Ошибка при обработке PDF: {str(e)}")
             raise
+        if info is not None:
+            info['pages'] = len(pages)
+
+        total, ocr_count, first = 0, 0, True
+        for page in pages:
+            ocr_count += page['source'] == 'ocr'
+            if not page['text'].strip():
+                continue
+            if not first:
+                yield "\n"
+            first = False
+            total += len(page['text'])
+            yield page['text']
+        logger.info(f"Из PDF извлечено {total} символов, страниц с OCR: {ocr_count}")
 
-    def _extract_from_pdf_standard(self, pdf_path: str) -> str:
-        """Извлечение текста из распознанного PDF файла"""
-        text = ""
+    def _extract_from_pdf_standard(self, pdf_path: str) -> Optional[List[Tuple[int, str]]]:
+        """
+        Извлечение текстового слоя PDF по страницам.
+        Возвращает None, если текстовый слой прочитать невозможно (например, файл зашифрован).
+        """
+        pages = []
         with open(pdf_path, 'rb') as file:
             reader = pypdf.PdfReader(file)
 
             # Проверяем, не зашифрован ли PDF
             if reader.is_encrypted:
                 logger.error("PDF файл зашифрован")
-                return ""
+                return None
             
             # Извлекаем текст со всех страниц
             for page_num, page in enumerate(reader.pages, 1):
                 try:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n"
-                    else:
+                    page_text = page.extract_text() or ""
+                    if not page_text:
                         logger.warning(f"На странице {page_num} не найден текст")
                 except Exception as e:
                     logger.error(f"Ошибка при обработке страницы {page_num}: {str(e)}")
-        
-        logger.info(f"Из файла PDF извлечено {len(text)} символов")
-        return text
+                    page_text = ""
+                pages.append((page_num, page_text))
+
+        logger.info(f"Из текстового слоя PDF извлечено {sum(len(text) for _, text in pages)} символов")
+        return pages
+
+    @staticmethod
+    def _has_text_layer(page_text: str, min_chars: int = 20, min_alnum_ratio: float = 0.5) -> bool:
+        """
+        Проверка, что текст страницы пригоден для использования без OCR:
+        достаточно символов и большая часть из них — буквы и цифры, а не мусор
+        от неправильно встроенных шрифтов.
+        """
+        chars = [char for char in page_text if not char.isspace()]
+        if len(chars) < min_chars:
+            return False
+        alnum = sum(1 for char in chars if char.isalnum())
+        return alnum / len(chars) >= min_alnum_ratio
 
     def _extract_from_pdf_with_ocr(self, pdf_path: str) -> str:
         """Извлечение текста из PDF с помощью OCR"""
+        pages = self._ocr_pdf_pages(pdf_path)
+        return "\n".join(f"{text}\n" for _, text in pages if text.strip())
 
+    def _ocr_pdf_pages(self, pdf_path: str, page_numbers: Optional[List[int]] = None,
+                       progress: Optional[ProgressCallback] = None) -> List[Tuple[int, str]]:
+        """
+        OCR выбранных страниц PDF (по умолчанию — всех).
+
+        Returns:
+            список (номер страницы, текст) в порядке страниц
+        """
         if not self.poppler_path:
             logger.error("Для распознавания текста в PDF укажите путь к poppler/bin")
         if not self.tesseract_cmd_path:
@@ -168,57 +291,106 @@ class TextExtractor:
         else:
             pytesseract.pytesseract.tesseract_cmd = self.tesseract_cmd_path
 
-        try:
-            # Конвертируем PDF в изображения
-            images = convert_from_path(pdf_path, dpi=300, poppler_path=self.poppler_path)
-            logger.info(f"PDF конвертирован в {len(images)} изображений для OCR")
+        if page_numbers is None:
+            try:
+                page_count = pdfinfo_from_path(pdf_path, poppler_path=self.poppler_path)['Pages']
+            except Exception as e:
+                logger.error(f"Ошибка при конвертации PDF в изображения: {str(e)}")
+                raise
+            page_numbers = list(range(1, page_count + 1))
 
-            text_parts = []
+        if not page_numbers:
+            return []
 
-            # Обрабатываем каждое изображение
-            for i, image in enumerate(images):
-                try:
-                    # Конвертируем в оттенки серого для лучшего распознавания
-                    if image.mode != 'L':
-                        image = image.convert('L')
+        workers = min(self.ocr_workers, len(page_numbers))
+        logger.info(f"OCR {len(page_numbers)} страниц PDF, процессов: {workers}")
 
-                    # Применяем OCR
-                    page_text = pytesseract.image_to_string(image, lang='rus+eng')
+        # Страницы растеризуются по одной внутри процессов OCR, поэтому в памяти
+        # одновременно находится не больше workers изображений
+        jobs = [(pdf_path, page_num, self.ocr_dpi, self.poppler_path)
+                for page_num in sorted(page_numbers)]
+        if workers == 1:
+            results = (ocr_worker.ocr_pdf_page(*job) for job in jobs)
+            return self._collect_ocr_pages(results, len(jobs), progress)
 
-                    if page_text and page_text.strip():
-                        text_parts.append(f"{page_text}\n")
-                        logger.debug(f"Страница {i + 1}: распознано {len(page_text)} символов")
-                    else:
-                        logger.debug(f"Страница {i + 1}: текст не распознан")
+        pool = self._get_ocr_pool()
+        try:
+            # map возвращает результаты в порядке страниц
+            results = pool.map(ocr_worker.ocr_pdf_page, *zip(*jobs))
+            return self._collect_ocr_pages(results, len(jobs), progress)
+        except BrokenProcessPool:
+            # Процесс OCR завершился аварийно (например, из-за нехватки памяти):
+            # пул пересоздается при следующем распознавании
+            self._close_ocr_pool(pool)
+            raise
 
-                except Exception as e:
-                    logger.error(f"Ошибка при OCR страницы {i + 1}: {str(e)}")
+    def _get_ocr_pool(self) -> ProcessPoolExecutor:
+        """Общий пул процессов OCR, создается при первом распознавании"""
+        with self._ocr_pool_lock:
+            if self._ocr_pool is None:
+                self._ocr_pool = ProcessPoolExecutor(max_workers=self.ocr_workers, mp_context=_ocr_mp_context(),
+                                                     initializer=ocr_worker.init_worker,
+                                                     initargs=(self.tesseract_cmd_path,))
+            return self._ocr_pool
 
-            return "\n".join(text_parts)
+    def _close_ocr_pool(self, pool: Optional[ProcessPoolExecutor] = None) -> None:
+        with self._ocr_pool_lock:
+            if pool is not None and pool is not self._ocr_pool:
+                return
+            pool, self._ocr_pool = self._ocr_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
 
-        except Exception as e:
-            logger.error(f"Ошибка при конвертации PDF в изображения: {str(e)}")
-            raise
+    def close(self) -> None:
+        """Остановка процессов OCR"""
+        self._close_ocr_pool()
+
+    def _collect_ocr_pages(self, results, total: int,
+                           progress: Optional[ProgressCallback] = None) -> List[Tuple[int, str]]:
+        """Сборка результатов OCR страниц в порядке их следования"""
+        pages = []
+        if progress:
+            progress('ocr', 0, total)
+        for done, (page_num, page_text, error, seconds) in enumerate(results, 1):
+            metrics.observe('ocr_page', seconds)
+            if error:
+                metrics.ERRORS.inc(stage='ocr_page')
+                logger.error(f"Ошибка при OCR страницы {page_num}: {error}")
+                page_text = ""
+            elif page_text and page_text.strip():
+                logger.debug(f"Страница {page_num}: распознано {len(page_text)} символов")
+            else:
+                logger.debug(f"Страница {page_num}: текст не распознан")
+            pages.append((page_num, page_text or ""))
+            if progress:
+                progress('ocr', done, total)
+
+        return pages
 
     def _extract_from_docx(self, docx_path: str) -> str:
         """Извлечение текста из DOCX файла"""
+        return "".join(self._iter_from_docx(docx_path))
+
+    def _iter_from_docx(self, docx_path: str) -> Iterator[str]:
+        """Текст DOCX по абзацам и ячейкам таблиц"""
         doc = Document(docx_path)
-        text = ""
-        
+        total = 0
+
         # Извлекаем текст из всех абзацев
         for paragraph in doc.paragraphs:
             if paragraph.text:
-                text += paragraph.text + "\n"
-        
+                total += len(paragraph.text) + 1
+                yield paragraph.text + "\n"
+
         # Извлекаем текст из таблиц
         for table in doc.tables:
             for row in table.rows:
                 for cell in row.cells:
                     if cell.text:
-                        text += cell.text + "\n"
-        
-        logger.info(f"Из файла DOCX извлечено {len(text)} символов")
-        return text
+                        total += len(cell.text) + 1
+                        yield cell.text + "\n"
+
+        logger.info(f"Из файла DOCX извлечено {total} символов")
     
     def _extract_from_image(self, image_path: str) -> str:
         """Извлечение текста с изображения с помощью OCR"""
@@ -231,40 +403,96 @@ class TextExtractor:
         image = Image.open(image_path)
         
         # Используем pytesseract для распознавания текста
-        text = pytesseract.image_to_string(image, lang='rus+eng')
+        with metrics.timed('ocr_page'):
+            text = pytesseract.image_to_string(image, lang='rus+eng')
         
         logger.info(f"С изображения извлечено {len(text)} символов")
         return text
     
+    def _iter_from_image(self, image_path: str) -> Iterator[str]:
+        """Текст изображения; распознавание начинается при чтении первого фрагмента"""
+        yield self._extract_from_image(image_path)
+
     def _extract_from_txt(self, txt_path: str) -> str:
         """Извлечение текста из текстового файла"""
-        # Пробуем разные кодировки
-        encodings = ['utf-8', 'cp1251', 'koi8-r', 'iso-8859-1']
-        
-        for enc in encodings:
+        return "".join(self._iter_from_txt(txt_path))
+
+    def _iter_from_txt(self, txt_path: str, block_size: int = 1024 * 1024) -> Iterator[str]:
+        """Чтение текстового файла блоками по block_size символов"""
+        encoding = self._detect_encoding(txt_path)
+        logger.info(f"Из файла TXT читается текст с кодировкой {encoding}")
+        # Кодировка определена по началу файла; некорректные байты дальше заменяются
+        with open(txt_path, 'r', encoding=encoding, errors='replace') as file:
+            while True:
+                block = file.read(block_size)
+                if not block:
+                    break
+                yield block
+
+    @staticmethod
+    def _detect_encoding(txt_path: str, sample_size: int = 64 * 1024) -> str:
+        """Определение кодировки по первым sample_size байтам файла"""
+        with open(txt_path, 'rb') as file:
+            sample = file.read(sample_size)
+
+        for enc in TXT_ENCODINGS:
             try:
-                with open(txt_path, 'r', encoding=enc) as file:
-                    text = file.read()
-                    logger.info(f"Из файла TXT прочитан текст с кодировкой {enc}")
-                    return text
+                # final=False: многобайтовый символ может быть обрезан на границе выборки
+                codecs.getincrementaldecoder(enc)().decode(sample, final=False)
+                return enc
             except UnicodeDecodeError:
                 continue
-        raise UnicodeDecodeError("Не удалось определить кодировку файла")
-    
+        raise ValueError("Не удалось определить кодировку файла")
+
     def _clean_text(self, text: str) -> str:
         """
         Очистка текста для дальнейшей обработки
         """
         if not text:
             return ""
-        
-        # Удаляем лишние пробелы
-        cleaned_text = re.sub(r'\s+', ' ', text)
-        # Сохраняем базовую пунктуацию, удаляем специальные символы
-        cleaned_text = re.sub(r'[^\w\s\n.,;:!?%-]', '', cleaned_text)
+        return "".join(self._iter_clean([text]))
+
+    @staticmethod
+    def _iter_clean(segments: Iterable[str]) -> Iterator[str]:
+        """
+        Потоковая очистка фрагментов текста. Результат совпадает с очисткой
+        всего текста целиком: пробелы схлопываются и на стыках фрагментов,
+        пробелы в начале и в конце текста удаляются.
+        """
+        pending_space = False  # предыдущий фрагмент закончился пробелом
+        held = ""              # пробелы в конце очищенного текста: выдаются, только если текст продолжится
+        started = False
+        total, head = 0, ""
+
+        for segment in segments:
+            if not segment:
+                continue
+            # Удаляем лишние пробелы
+            collapsed = WHITESPACE_PATTERN.sub(' ', segment)
+            if pending_space and collapsed.startswith(' '):
+                collapsed = collapsed[1:]
+            if not collapsed:
+                continue
+            pending_space = collapsed.endswith(' ')
+
+            cleaned = SPECIAL_CHARS_PATTERN.sub('', collapsed)
+            if not started:
+                cleaned = cleaned.lstrip()
+            body = cleaned.rstrip()
+            if not body:
+                if started:
+                    held += cleaned
+                continue
+
+            piece = held + body
+            held = cleaned[len(body):]
+            started = True
+            total += len(piece)
+            if len(head) < 100:
+                head += piece[:100 - len(head)]
+            yield piece
 
-        logger.info(f"Извлеченный текст: '{cleaned_text[:100]}...{cleaned_text[-100:]}'")
-        return cleaned_text.strip()
+        logger.info(f"Извлеченный текст: {total} символов, начало: '{head}...'")
 
 
 if __name__ == '__main__':